@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Crop, MarketPrice, ProduceListing, Cart, Order, Payment, SMSLogs, USSDSession
+from .models import User, Crop, MarketPrice, MarketPriceHistory, MarketPriceRollup, ProduceListing, Cart, Order, Payment, PaymentCallback, SMSLogs, SMSOutbox, USSDSession
 
 class ReadOnlyAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
@@ -19,7 +19,11 @@ admin.site.register(MarketPrice)
 admin.site.register(ProduceListing, ReadOnlyAdmin)
 admin.site.register(Order, ReadOnlyAdmin)
 admin.site.register(Payment, ReadOnlyAdmin)
+admin.site.register(PaymentCallback, ReadOnlyAdmin)
+admin.site.register(MarketPriceHistory, ReadOnlyAdmin)
+admin.site.register(MarketPriceRollup, ReadOnlyAdmin)
 admin.site.register(SMSLogs, ReadOnlyAdmin)
+admin.site.register(SMSOutbox, ReadOnlyAdmin)
 admin.site.register(USSDSession, ReadOnlyAdmin) 
 
 @admin.register(User)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MlimiZoneConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mlimi_zone'
+
+    def ready(self):
+        from . import checks, signals
@@ -0,0 +1,103 @@
+from django.core.cache import cache
+from .models import MarketPrice, MarketPriceRollup, Crop
+import threading
+import time
+
+VERSION_KEY = 'mlimizone:version:%s'
+MODIFIED_KEY = 'mlimizone:modified:%s'
+PRICE_MENU_KEY = 'ussd:prices:%s:%s'
+PRICE_MENU_TIMEOUT = 60 * 60 * 24
+PRICE_TREND_KEY = 'ussd:trend:%s:%s:%s'
+PRICE_TREND_WEEKS = 4
+
+# Per-process copy of the Crop table for USSD menus: (version, rows, menu_lines).
+_crop_catalog = None
+_crop_catalog_lock = threading.Lock()
+
+
+def get_version(name):
+    key = VERSION_KEY % name
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so a version key lost to eviction can never
+        # resurrect entries cached under an older value.
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    cache.set(MODIFIED_KEY % name, time.time(), None)
+    try:
+        cache.incr(VERSION_KEY % name)
+    except ValueError:
+        get_version(name)
+
+
+def last_modified(name):
+    # Wall-clock time of the last bump; an evicted value restarts at now,
+    # which only makes clients revalidate.
+    modified = cache.get(MODIFIED_KEY % name)
+    if modified is None:
+        cache.add(MODIFIED_KEY % name, time.time(), None)
+        modified = cache.get(MODIFIED_KEY % name)
+    return modified
+
+
+def crop_catalog():
+    # Rebuilt only when the shared 'crop' version moves, so every worker picks
+    # up crop edits on its next hop while normal hops cost one cache read.
+    global _crop_catalog
+    version = get_version('crop')
+    catalog = _crop_catalog
+    if catalog is None or catalog[0] != version:
+        with _crop_catalog_lock:
+            catalog = _crop_catalog
+            if catalog is None or catalog[0] != version:
+                rows = list(Crop.objects.order_by('crop_id').values_list('crop_id', 'crop_name'))
+                lines = "\n".join(f"{number}. {crop_name}" for number, (_, crop_name) in enumerate(rows, 1))
+                catalog = _crop_catalog = (version, rows, lines)
+    return catalog
+
+
+def crop_choices():
+    return crop_catalog()[1]
+
+
+def crop_menu_lines():
+    return crop_catalog()[2]
+
+
+def crop_for_choice(choice):
+    # Menu number -> (crop_id, crop_name), or None.
+    rows = crop_choices()
+    if not choice.isdigit() or not 1 <= int(choice) <= len(rows):
+        return None
+    return rows[int(choice) - 1]
+
+
+def price_menu_lines(crop_id, crop_name):
+    key = PRICE_MENU_KEY % (get_version('marketprice'), crop_id)
+    lines = cache.get(key)
+    if lines is None:
+        prices = MarketPrice.objects.filter(crop_id=crop_id).order_by('location').values_list('location', 'price_per_unit')
+        lines = "\n".join(f"{crop_name}: {location} {price} MWK" for location, price in prices)
+        cache.set(key, lines, PRICE_MENU_TIMEOUT)
+    return lines
+
+
+def price_trend_lines(crop_id, location):
+    # Newest weeks first, read from the weekly rollups by their unique index
+    # so the cost is the same after years of history.
+    key = PRICE_TREND_KEY % (get_version('marketprice'), crop_id, location.replace(' ', '_'))
+    lines = cache.get(key)
+    if lines is None:
+        weeks = MarketPriceRollup.objects.filter(
+            crop_id=crop_id, location=location, period='week'
+        ).order_by('-period_start')[:PRICE_TREND_WEEKS]
+        lines = "\n".join(
+            f"{week.period_start:%d %b}: avg {week.avg_price:.0f} ({week.min_price:.0f}-{week.max_price:.0f})"
+            for week in weeks
+        )
+        cache.set(key, lines, PRICE_MENU_TIMEOUT)
+    return lines
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    # Cache version bumps only reach the process that made them with locmem,
+    # so other workers would keep serving stale menus and ETags.
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend.endswith('LocMemCache'):
+        return [Warning(
+            "The default cache is per-process LocMemCache; price menus, ETags and the crop catalog "
+            "will not be invalidated across worker processes.",
+            hint="Set CACHE_BACKEND to a shared backend (file, database, memcached, redis) unless you run a single worker.",
+            id='mlimi_zone.W001',
+        )]
+    return []
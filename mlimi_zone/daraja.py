@@ -1,11 +1,24 @@
 import os
+import time
+import hashlib
+import threading
 import requests
+from django.core.cache import cache
+from . import httpclient
 from datetime import datetime
 from base64 import b64encode
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Tokens are refreshed this long before Daraja says they expire, while the
+# current one is still handed out to concurrent callers.
+TOKEN_REFRESH_MARGIN = 300
+TOKEN_LOCK_TIMEOUT = 15
+TOKEN_WAIT_INTERVAL = 0.1
+_token_lock = threading.Lock()
+STK_QUERY_IN_PROGRESS = '500.001.1001'
+
 class DarajaClient:
     def __init__(self):
         self.consumer_key = os.getenv('DARJA_CONSUMER_KEY')
@@ -15,7 +28,7 @@ class DarajaClient:
         self.callback_url = "https://mydomain.com/path"
         self.callback_url = self.callback_url.strip()
         sandbox_mode = os.getenv('SANDBOX_MODE', 'True').lower() == 'true'
-        self.base_url = 'https://sandbox.safaricom.co.ke' if sandbox_mode else 'https://api.safaricom.co.ke'
+        self.base_url = os.getenv('DARJA_BASE_URL') or ('https://sandbox.safaricom.co.ke' if sandbox_mode else 'https://api.safaricom.co.ke')
         self.access_token = None
 
         missing = []
@@ -33,24 +46,85 @@ class DarajaClient:
 
         logger.info(f"DarajaClient initialized with HARDCODED callback URL: {repr(self.callback_url)}")
 
+    @property
+    def token_cache_key(self):
+        digest = hashlib.sha256(f"{self.base_url}:{self.consumer_key}".encode()).hexdigest()[:16]
+        return f"daraja:token:{digest}"
+
     def get_access_token(self):
+        key = self.token_cache_key
+        entry = cache.get(key)
+        if entry and time.time() < entry['refresh_at']:
+            self.access_token = entry['token']
+            return self.access_token
+        # Single flight: whoever adds the cache lock fetches. _token_lock only
+        # covers the re-check and claim; fetching and waiting happen outside it
+        # so other threads keep using the current token meanwhile.
+        with _token_lock:
+            entry = cache.get(key)
+            if entry and time.time() < entry['refresh_at']:
+                self.access_token = entry['token']
+                return self.access_token
+            claimed = cache.add(f"{key}:lock", 1, TOKEN_LOCK_TIMEOUT)
+        if claimed:
+            try:
+                self.access_token = self.fetch_access_token()
+            except ValueError:
+                # The entry only lives until shortly before Daraja expires it,
+                # so a failed early refresh can keep serving it.
+                if not entry:
+                    raise
+                logger.warning("Access token refresh failed; using the cached token until it expires.")
+                self.access_token = entry['token']
+            finally:
+                cache.delete(f"{key}:lock")
+            return self.access_token
+        if entry:
+            self.access_token = entry['token']
+            return self.access_token
+        deadline = time.monotonic() + TOKEN_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(TOKEN_WAIT_INTERVAL)
+            entry = cache.get(key)
+            if entry:
+                self.access_token = entry['token']
+                return self.access_token
+        self.access_token = self.fetch_access_token()
+        return self.access_token
+
+    def invalidate_access_token(self):
+        cache.delete(self.token_cache_key)
+        self.access_token = None
+
+    def fetch_access_token(self):
         url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
         auth = b64encode(f"{self.consumer_key}:{self.consumer_secret}".encode()).decode()
         headers = {'Authorization': f'Basic {auth}'}
+        response = None
         try:
-            response = requests.get(url, headers=headers, timeout=10)
+            response = httpclient.get(url, 'daraja.oauth', headers=headers)
             response.raise_for_status()
-            token = response.json().get('access_token')
+            body = response.json()
+            token = body.get('access_token')
             if not token:
                 raise ValueError("No access token in response")
-            self.access_token = token
-            logger.info("Access token acquired.")
+            expires_in = int(body.get('expires_in', 3599))
+            now = time.time()
+            cache.set(
+                self.token_cache_key,
+                {'token': token, 'refresh_at': now + max(expires_in - TOKEN_REFRESH_MARGIN, expires_in // 2)},
+                max(expires_in - 30, 1),
+            )
+            logger.info(f"Access token acquired, expires in {expires_in}s.")
             return token
         except Exception as e:
-            error_text = getattr(response, 'text', str(e))
+            error_text = getattr(response, 'text', None) or str(e)
             logger.error(f"Failed to get access token: {error_text}")
             raise ValueError(f"Access token error: {error_text}")
 
+    def password(self, timestamp):
+        return b64encode(f"{self.business_shortcode}{self.passkey}{timestamp}".encode()).decode()
+
     def stk_push(self, phone_number, amount, account_reference="MlimiZone", transaction_desc="Payment for crops"):
         if not isinstance(phone_number, str) or not phone_number.startswith('254') or len(phone_number) != 12:
             return {'error': 'Invalid phone number. Must be 254XXXXXXXXX'}
@@ -65,14 +139,13 @@ class DarajaClient:
         if not self.callback_url.startswith('https://'):
             return {'error': 'CallBackURL must be HTTPS'}
 
-        if not self.access_token:
-            try:
-                self.get_access_token()
-            except Exception as e:
-                return {'error': f"Authentication failed: {str(e)}"}
+        try:
+            self.get_access_token()
+        except Exception as e:
+            return {'error': f"Authentication failed: {str(e)}"}
 
         timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        password = b64encode(f"{self.business_shortcode}{self.passkey}{timestamp}".encode()).decode()
+        password = self.password(timestamp)
         logger.info(f"Sending STK Push with CallBackURL: {repr(self.callback_url)}")
 
         payload = {
@@ -96,15 +169,53 @@ class DarajaClient:
 
         url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=10)
+            response = httpclient.post(url, 'daraja.stk_push', json=payload, headers=headers)
             response.raise_for_status()
             result = response.json()
             logger.info(f"STK Push successful: {result}")
             return result
         except requests.exceptions.HTTPError as e:
+            if getattr(e.response, 'status_code', None) == 401:
+                self.invalidate_access_token()
             error_text = getattr(e.response, 'text', 'No response')
             logger.error(f"STK Push failed: {error_text}")
             return {'error': f"HTTP error: {error_text}"}
         except Exception as e:
             logger.error(f"Network error: {str(e)}")
-            return {'error': f"Network error: {str(e)}"}
\ No newline at end of file
+            return {'error': f"Network error: {str(e)}"}
+
+    def stk_query(self, checkout_request_id):
+        # Daraja answers an HTTP 500 with STK_QUERY_IN_PROGRESS while the
+        # customer has not yet acted on the prompt; that comes back as an error dict.
+        try:
+            self.get_access_token()
+        except Exception as e:
+            return {'error': f"Authentication failed: {str(e)}"}
+
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        payload = {
+            "BusinessShortCode": self.business_shortcode,
+            "Password": self.password(timestamp),
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id
+        }
+        headers = {
+            'Authorization': f'Bearer {self.access_token}',
+            'Content-Type': 'application/json'
+        }
+
+        url = f"{self.base_url}/mpesa/stkpushquery/v1/query"
+        response = None
+        try:
+            response = httpclient.post(url, 'daraja.stk_query', json=payload, headers=headers)
+            if response.status_code == 401:
+                self.invalidate_access_token()
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            error_text = getattr(response, 'text', None) or str(e)
+            if STK_QUERY_IN_PROGRESS in error_text:
+                logger.info(f"STK query for {checkout_request_id}: still being processed")
+            else:
+                logger.warning(f"STK query for {checkout_request_id} failed: {error_text}")
+            return {'error': error_text}
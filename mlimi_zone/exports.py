@@ -0,0 +1,115 @@
+import csv
+from datetime import datetime, time, timedelta
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Order, Payment, SMSLogs, ORDER_STATUS_CHOICES, PAYMENT_STATUS_CHOICES, SMS_STATUS_CHOICES
+
+CHUNK_SIZE = 2000
+LINES_PER_WRITE = 500
+FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# name -> (queryset, date field, status field, status choices, columns). Rows are
+# read with values_list, so exports never build model instances.
+EXPORTS = {
+    'orders': (
+        Order.objects.all(), 'created_at', 'status', ORDER_STATUS_CHOICES, (
+            'order_id', 'created_at', 'updated_at', 'status', 'price', 'cart_id',
+            'wholesaler_id', 'wholesaler__phone_number', 'croplisting_id',
+            'croplisting__crop__crop_name', 'croplisting__quantity', 'croplisting__farmer_id',
+        ),
+    ),
+    'payments': (
+        Payment.objects.all(), 'created_at', 'payment_status', PAYMENT_STATUS_CHOICES, (
+            'payment_id', 'created_at', 'payment_status', 'amount', 'transaction_ref',
+            'order_id', 'order__status', 'order__wholesaler__phone_number',
+        ),
+    ),
+    'smslogs': (
+        SMSLogs.objects.all(), 'sent_at', 'status', SMS_STATUS_CHOICES, (
+            'smslog_id', 'sent_at', 'status', 'user_id', 'user__phone_number', 'message_body',
+        ),
+    ),
+}
+
+
+class ExportError(ValueError):
+    pass
+
+
+def parse_bound(value, name):
+    # Returns (moment, is_date): a bare date becomes midnight in the current
+    # timezone. parse_datetime also accepts bare dates, so dates are tried first.
+    day = parse_date(value)
+    if day is not None:
+        return timezone.make_aware(datetime.combine(day, time.min)), True
+    moment = parse_datetime(value)
+    if moment is None:
+        raise ExportError(f"{name} must be YYYY-MM-DD or an ISO datetime.")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment, False
+
+
+def export_queryset(name, since=None, until=None, status=None):
+    # since is inclusive, until exclusive; a bare until date covers that whole day.
+    if name not in EXPORTS:
+        raise ExportError(f"Unknown export '{name}'; choose from {', '.join(EXPORTS)}.")
+    queryset, date_field, status_field, status_choices, columns = EXPORTS[name]
+    if since:
+        queryset = queryset.filter(**{f'{date_field}__gte': parse_bound(since, 'since')[0]})
+    if until:
+        bound, is_date = parse_bound(until, 'until')
+        if is_date:
+            bound += timedelta(days=1)
+        queryset = queryset.filter(**{f'{date_field}__lt': bound})
+    if status:
+        if status not in dict(status_choices):
+            raise ExportError(f"status must be one of {', '.join(dict(status_choices))}.")
+        queryset = queryset.filter(**{status_field: status})
+    # (date, pk) order walks the created/sent indexes for date-range exports.
+    return queryset.order_by(date_field, 'pk').values_list(*columns)
+
+
+def export_columns(name):
+    return EXPORTS[name][4]
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+
+
+def ndjson_lines(columns, rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(columns, row))) + "\n"
+
+
+def joined(lines, size=LINES_PER_WRITE):
+    # Hands the server a few KB per write instead of one short row at a time.
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def export_lines(name, file_format='csv', since=None, until=None, status=None, chunk_size=CHUNK_SIZE):
+    # Validates eagerly, then returns a generator: the iterator holds one
+    # chunk of rows at a time however large the table is.
+    if file_format not in FORMATS:
+        raise ExportError(f"type must be one of {', '.join(FORMATS)}.")
+    rows = export_queryset(name, since, until, status).iterator(chunk_size=chunk_size)
+    lines = csv_lines if file_format == 'csv' else ndjson_lines
+    return joined(lines(export_columns(name), rows))
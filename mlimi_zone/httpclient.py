@@ -0,0 +1,83 @@
+import os
+import time
+import logging
+from collections import defaultdict
+from threading import Lock
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 10))
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 20))
+# Retries cover connection failures for every method (nothing was sent yet) but
+# only re-send on 5xx / read errors for idempotent methods, so a POST that may
+# have reached SMSLeopard or Daraja is never repeated here.
+RETRIES = Retry(
+    total=2,
+    connect=2,
+    backoff_factor=0.3,
+    status_forcelist=(502, 503, 504),
+    allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+    raise_on_status=False,
+)
+
+
+class LatencyStats:
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = defaultdict(lambda: {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+
+    def record(self, name, elapsed_ms, ok):
+        with self._lock:
+            stats = self._calls[name]
+            stats["count"] += 1
+            stats["errors"] += 0 if ok else 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {**stats, "avg_ms": stats["total_ms"] / stats["count"]}
+                for name, stats in self._calls.items()
+            }
+
+
+latency_stats = LatencyStats()
+
+
+def build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=POOL_MAXSIZE, max_retries=RETRIES)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# One keep-alive session per process; urllib3 keeps a connection pool per host inside it.
+session = build_session()
+
+
+def request(method, url, name, **kwargs):
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    start = time.perf_counter()
+    ok = False
+    try:
+        response = session.request(method, url, **kwargs)
+        ok = response.status_code < 500
+        return response
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        latency_stats.record(name, elapsed_ms, ok)
+        logger.info(f"{name} {method} took {elapsed_ms:.1f} ms")
+
+
+def get(url, name, **kwargs):
+    return request("GET", url, name, **kwargs)
+
+
+def post(url, name, **kwargs):
+    return request("POST", url, name, **kwargs)
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from mlimi_zone.payments import apply_callback_batch, replay_callbacks
+
+
+class Command(BaseCommand):
+    help = "Apply buffered M-Pesa callbacks to payments and orders in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=0.0, help="Keep polling every N seconds; 0 drains once and exits.")
+        parser.add_argument('--replay-from', type=int, help="Mark callbacks from this callback_id onwards as unapplied before starting.")
+
+    def handle(self, *args, **options):
+        if options['replay_from'] is not None:
+            reset = replay_callbacks(options['replay_from'])
+            self.stdout.write(f"Replaying {reset} callbacks from offset {options['replay_from']}.")
+        total = 0
+        while True:
+            applied = apply_callback_batch(options['batch_size'])
+            total += applied
+            if applied:
+                continue
+            if not options['interval']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f"Applied {total} callbacks."))
@@ -0,0 +1,96 @@
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+from mlimi_zone.caching import bump_version
+from mlimi_zone.models import User, Crop, MarketPrice, ProduceListing, Cart, Order, Payment
+from mlimi_zone.views import (
+    ProduceListingViewSet, CartViewSet, OrderViewSet, PaymentViewSet, MarketPriceViewSet, CropViewSet
+)
+
+# (name, viewset, role making the request, model whose first row is retrieved)
+ENDPOINTS = [
+    ('croplistings', ProduceListingViewSet, 'farmer', ProduceListing),
+    ('carts', CartViewSet, 'wholesaler', Cart),
+    ('orders (wholesaler)', OrderViewSet, 'wholesaler', Order),
+    ('orders (farmer)', OrderViewSet, 'farmer', Order),
+    ('payments (wholesaler)', PaymentViewSet, 'wholesaler', Payment),
+    ('payments (farmer)', PaymentViewSet, 'farmer', Payment),
+    ('marketprices', MarketPriceViewSet, None, MarketPrice),
+    ('crops', CropViewSet, None, Crop),
+]
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Count SQL queries per API list/retrieve at two dataset sizes; fails if any count grows with the rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs=2, default=[10, 1000])
+
+    def handle(self, *args, **options):
+        counts = {}
+        for size in options['sizes']:
+            try:
+                with transaction.atomic():
+                    users = self.seed(size)
+                    for name, viewset, role, model in ENDPOINTS:
+                        for action in ('list', 'retrieve'):
+                            counts[name, action, size] = self.measure(viewset, action, users.get(role), model)
+                    raise _Rollback
+            except _Rollback:
+                pass
+        bump_version('marketprice')
+        bump_version('crop')
+        small, large = options['sizes']
+        regressions = []
+        for name, _, _, _ in ENDPOINTS:
+            for action in ('list', 'retrieve'):
+                (q_small, ms_small), (q_large, ms_large) = counts[name, action, small], counts[name, action, large]
+                self.stdout.write(f"{name} {action}: {q_small} queries @{small} ({ms_small:.1f} ms), {q_large} queries @{large} ({ms_large:.1f} ms)")
+                if q_large != q_small:
+                    regressions.append(f"{name} {action}")
+        if regressions:
+            raise CommandError(f"Query count grows with rows for: {', '.join(regressions)}")
+
+    def measure(self, viewset, action, user, model):
+        factory = APIRequestFactory()
+        request = factory.get('/', HTTP_HOST='localhost')
+        if user:
+            force_authenticate(request, user=user)
+        kwargs = {}
+        if action == 'retrieve':
+            kwargs['pk'] = model.objects.order_by('pk').values_list('pk', flat=True).first()
+        view = viewset.as_view({'get': action})
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request, **kwargs)
+            response.render()
+        elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code != 200:
+            raise CommandError(f"{viewset.__name__} {action} returned {response.status_code}")
+        return len(queries), elapsed
+
+    def seed(self, size):
+        farmer = User.objects.create(name='Bench Farmer', role='farmer', location='Blantyre', phone_number='254700000011')
+        wholesaler = User.objects.create(name='Bench Wholesaler', role='wholesaler', location='Lilongwe', phone_number='254700000012')
+        cart = Cart.objects.get(wholesaler=wholesaler)
+        crops = Crop.objects.bulk_create(Crop(crop_name=f'Bench crop {i}') for i in range(size))
+        MarketPrice.objects.bulk_create(
+            MarketPrice(crop=crop, location='Southern Region', price_per_unit=Decimal('500')) for crop in crops
+        )
+        listings = ProduceListing.objects.bulk_create(
+            ProduceListing(farmer=farmer, crop=crop, quantity=Decimal('100')) for crop in crops
+        )
+        orders = Order.objects.bulk_create(
+            Order(cart=cart, wholesaler=wholesaler, croplisting=listing, price=Decimal('50000')) for listing in listings
+        )
+        Payment.objects.bulk_create(
+            Payment(order=order, amount=order.price, payment_status='pending') for order in orders
+        )
+        return {'farmer': farmer, 'wholesaler': wholesaler}
@@ -0,0 +1,95 @@
+import random
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, IntegrityError
+from django.db.models import Count
+from mlimi_zone.caching import bump_version
+from mlimi_zone.models import User, Crop, MarketPrice, ProduceListing, Order
+from mlimi_zone.ussd import book_listing, ListingTaken
+
+CROP_NAME = 'Bench booking crop'
+PHONE_PREFIX = '2657300'
+
+
+class Command(BaseCommand):
+    help = "Hammer listing bookings from concurrent wholesalers and check nothing is double-booked."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=200)
+        parser.add_argument('--wholesalers', type=int, default=16, help="Concurrent booking threads, one wholesaler each.")
+        parser.add_argument('--attempts', type=int, default=50, help="Booking attempts per wholesaler.")
+
+    def handle(self, *args, **options):
+        # Threads need their own connections, so the data is committed and deleted afterwards.
+        self.cleanup()
+        try:
+            wholesalers, listing_ids = self.seed(options)
+            outcomes = Counter()
+            lock = threading.Lock()
+
+            def run(wholesaler):
+                picker = random.Random(wholesaler.pk)
+                local = Counter()
+                try:
+                    for _ in range(options['attempts']):
+                        start = time.perf_counter()
+                        try:
+                            book_listing(wholesaler, picker.choice(listing_ids))
+                            local['booked'] += 1
+                        except (ListingTaken, IntegrityError):
+                            local['taken'] += 1
+                        except Exception as e:
+                            local[f'error: {type(e).__name__}'] += 1
+                        local['ms'] += (time.perf_counter() - start) * 1000
+                finally:
+                    close_old_connections()
+                with lock:
+                    outcomes.update(local)
+
+            threads = [threading.Thread(target=run, args=(wholesaler,)) for wholesaler in wholesalers]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            attempts = len(wholesalers) * options['attempts']
+            orders = Order.objects.filter(croplisting__crop__crop_name=CROP_NAME)
+            doubled = orders.values('croplisting').annotate(n=Count('pk')).filter(n__gt=1).count()
+            unavailable = ProduceListing.objects.filter(crop__crop_name=CROP_NAME, is_available=False).count()
+            stale = ProduceListing.objects.filter(crop__crop_name=CROP_NAME).inconsistent().count()
+            self.stdout.write(
+                f"{attempts} attempts in {elapsed:.2f}s ({attempts / elapsed:.0f}/s, avg {outcomes['ms'] / attempts:.1f} ms): "
+                f"{outcomes['booked']} booked, {outcomes['taken']} lost the race"
+            )
+            for key, count in outcomes.items():
+                if key.startswith('error'):
+                    self.stdout.write(f"{key}: {count}")
+            self.stdout.write(f"Orders: {orders.count()}, listings marked booked: {unavailable}, double-booked: {doubled}, stale flags: {stale}")
+            if doubled or stale or orders.count() != outcomes['booked']:
+                raise CommandError("Booking invariants violated.")
+        finally:
+            self.cleanup()
+            bump_version('marketprice')
+            bump_version('crop')
+
+    def seed(self, options):
+        crop = Crop.objects.create(crop_name=CROP_NAME)
+        MarketPrice.objects.create(crop=crop, location='Southern Region', price_per_unit=Decimal('500'))
+        farmer = User.objects.create(name='Bench booking farmer', role='farmer', location='Blantyre', phone_number=f'{PHONE_PREFIX}99999')
+        wholesalers = [
+            User.objects.create(name=f'Bench booking wholesaler {i}', role='wholesaler', location='Lilongwe', phone_number=f'{PHONE_PREFIX}{i:05d}')
+            for i in range(options['wholesalers'])
+        ]
+        listings = ProduceListing.objects.bulk_create(
+            ProduceListing(farmer=farmer, crop=crop, quantity=Decimal('100')) for _ in range(options['listings'])
+        )
+        return wholesalers, [listing.croplisting_id for listing in listings]
+
+    def cleanup(self):
+        User.objects.filter(phone_number__startswith=PHONE_PREFIX).delete()
+        Crop.objects.filter(crop_name=CROP_NAME).delete()
@@ -0,0 +1,92 @@
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from mlimi_zone.caching import bump_version
+from mlimi_zone.models import User, Crop, MarketPrice, ProduceListing, Cart, Order, SMSLogs, DISTRICT_TO_REGION
+
+BATCH = 2000
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN and time the hot USSD/API queries on a large throwaway dataset."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--listings', type=int, default=50000)
+        parser.add_argument('--booked', type=float, default=0.8, help="Fraction of listings that already have an order.")
+        parser.add_argument('--sms-logs', type=int, default=50000)
+        parser.add_argument('--runs', type=int, default=50)
+        parser.add_argument('--no-explain', action='store_true')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                start = time.perf_counter()
+                queries = self.seed(options)
+                self.stdout.write(f"Seeded in {time.perf_counter() - start:.1f}s")
+                for name, queryset in queries:
+                    self.measure(name, queryset, options)
+                raise _Rollback
+        except _Rollback:
+            pass
+        bump_version('marketprice')
+        bump_version('crop')
+
+    def measure(self, name, queryset, options):
+        timings = []
+        for _ in range(options['runs']):
+            start = time.perf_counter()
+            list(queryset.all())
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{name}: median {statistics.median(timings):.2f} ms, max {max(timings):.2f} ms"
+        ))
+        if not options['no_explain']:
+            self.stdout.write(queryset.explain())
+
+    def seed(self, options):
+        regions = sorted(set(DISTRICT_TO_REGION.values()))
+        crops = Crop.objects.bulk_create(Crop(crop_name=f'Bench index crop {i}') for i in range(20))
+        MarketPrice.objects.bulk_create(
+            MarketPrice(crop=crop, location=region, price_per_unit=Decimal('500')) for crop in crops for region in regions
+        )
+        farmers = User.objects.bulk_create(
+            User(name=f'Bench farmer {i}', role='farmer', location='Lilongwe', phone_number=f'2657100{i:05d}') for i in range(2000)
+        )
+        wholesalers = User.objects.bulk_create(
+            User(name=f'Bench wholesaler {i}', role='wholesaler', location='Blantyre', phone_number=f'2657200{i:05d}') for i in range(200)
+        )
+        carts = Cart.objects.bulk_create(Cart(wholesaler=wholesaler) for wholesaler in wholesalers)
+        booked = int(options['listings'] * options['booked'])
+        listings = ProduceListing.objects.bulk_create(
+            (ProduceListing(farmer=farmers[i % len(farmers)], crop=crops[i % len(crops)], quantity=Decimal('100'), is_available=i >= booked)
+             for i in range(options['listings'])),
+            batch_size=BATCH,
+        )
+        Order.objects.bulk_create(
+            (Order(cart=carts[i % len(carts)], wholesaler=wholesalers[i % len(wholesalers)], croplisting=listing,
+                   price=Decimal('50000'), status='paid' if i % 4 else 'unpaid')
+             for i, listing in enumerate(listings[:booked])),
+            batch_size=BATCH,
+        )
+        SMSLogs.objects.bulk_create(
+            (SMSLogs(user=farmers[i % len(farmers)], message_body='Bench message', status='delivered')
+             for i in range(options['sms_logs'])),
+            batch_size=BATCH,
+        )
+        crop, farmer, wholesaler = crops[3], farmers[7], wholesalers[5]
+        return [
+            ('market price by (crop, location)', MarketPrice.objects.filter(crop=crop, location=regions[0])[:1]),
+            ('region prices for a crop', MarketPrice.objects.filter(crop__crop_name=crop.crop_name).order_by('location').values_list('location', 'price_per_unit')),
+            ('open listings page for a crop', ProduceListing.objects.available().filter(crop__crop_name=crop.crop_name).select_related('farmer').order_by('croplisting_id')[:11]),
+            ('unpaid orders page for a wholesaler', Order.objects.filter(wholesaler=wholesaler, status='unpaid').select_related('croplisting__crop', 'croplisting__farmer').order_by('order_id')[:11]),
+            ('recent SMS for a user', SMSLogs.objects.filter(user=farmer, sent_at__gte=timezone.now() - timedelta(days=30)).order_by('-sent_at')[:50]),
+            ('user by normalized phone', User.objects.filter(phone_number=farmer.phone_number)),
+        ]
@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from mlimi_zone.httpclient import latency_stats
+from mlimi_zone.models import User, Crop, ProduceListing, Cart, Order, Payment
+from mlimi_zone.payments import reconcile_pending_payments
+
+
+class StubDarajaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.05
+    queries = 0
+
+    def do_GET(self):
+        self.reply(200, {'access_token': 'stub-token', 'expires_in': '3599'})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        StubDarajaHandler.queries += 1
+        time.sleep(self.latency)
+        # The last digit of the checkout id picks the outcome: paid, cancelled or still processing.
+        outcome = int(body['CheckoutRequestID'][-1]) % 3
+        if outcome == 2:
+            self.reply(500, {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'})
+        else:
+            result_code = '0' if outcome == 0 else '1032'
+            self.reply(200, {'ResponseCode': '0', 'CheckoutRequestID': body['CheckoutRequestID'], 'ResultCode': result_code, 'ResultDesc': 'stub'})
+
+    def reply(self, status, payload):
+        payload = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Reconcile seeded stale pending payments against a local Daraja stub and roll everything back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=300)
+        parser.add_argument('--latency', type=float, default=0.05, help="Stub response delay in seconds.")
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--chunk-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        StubDarajaHandler.latency = options['latency']
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubDarajaHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        overrides = {
+            'DARJA_BASE_URL': f"http://127.0.0.1:{server.server_port}",
+            'DARJA_CONSUMER_KEY': 'stub', 'DARJA_CONSUMER_SECRET': 'stub',
+            'DARJA_SHORTCODE': '174379', 'DARJA_PASSKEY': 'stub',
+        }
+        original_env = {name: os.environ.get(name) for name in overrides}
+        os.environ.update(overrides)
+        try:
+            for workers in (1, options['workers']):
+                self.run(workers, options)
+        finally:
+            for name, value in original_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            server.shutdown()
+        for name, stats in latency_stats.snapshot().items():
+            self.stdout.write(f"{name}: {stats['count']} calls, avg {stats['avg_ms']:.1f} ms, max {stats['max_ms']:.1f} ms, {stats['errors']} errors")
+
+    def run(self, workers, options):
+        StubDarajaHandler.queries = 0
+        try:
+            with transaction.atomic():
+                self.seed(options['payments'])
+                start = time.perf_counter()
+                checked, completed, failed = reconcile_pending_payments(timedelta(0), options['chunk_size'], workers)
+                elapsed = time.perf_counter() - start
+                paid = Order.objects.filter(status='paid').count()
+                raise _Rollback
+        except _Rollback:
+            pass
+        self.stdout.write(
+            f"{workers} workers: checked {checked} in {elapsed:.2f}s ({checked / elapsed:.0f} payments/s), "
+            f"{completed} completed ({paid} orders paid), {failed} failed, {StubDarajaHandler.queries} STK queries"
+        )
+
+    def seed(self, count):
+        crop = Crop.objects.create(crop_name='Bench reconcile crop')
+        farmer = User.objects.create(name='Bench farmer', role='farmer', phone_number='265990000001')
+        wholesalers = User.objects.bulk_create(
+            User(name=f'Bench wholesaler {i}', role='wholesaler', phone_number=f'2547980{i:05d}') for i in range(count)
+        )
+        carts = Cart.objects.bulk_create(Cart(wholesaler=wholesaler) for wholesaler in wholesalers)
+        listings = ProduceListing.objects.bulk_create(
+            ProduceListing(farmer=farmer, crop=crop, quantity=Decimal('10')) for _ in range(count)
+        )
+        orders = Order.objects.bulk_create(
+            Order(cart=cart, croplisting=listing, wholesaler=cart.wholesaler, price=Decimal('100'), status='unpaid')
+            for listing, cart in zip(listings, carts)
+        )
+        Payment.objects.bulk_create(
+            Payment(order=order, amount=order.price, payment_status='pending', transaction_ref=f'ws_CO_bench_{i}')
+            for i, order in enumerate(orders)
+        )
@@ -0,0 +1,80 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from mlimi_zone import sms
+from mlimi_zone.httpclient import latency_stats
+from mlimi_zone.models import User, SMSOutbox
+from mlimi_zone.outbox import drain_outbox, queue_bulk_sms
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.05
+    requests = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        StubHandler.requests += 1
+        time.sleep(self.latency)
+        payload = json.dumps({'success': True, 'recipients': [{'number': d['number'], 'status': 'queued'} for d in body['destination']]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare per-message and grouped outbox delivery against a local SMSLeopard stub."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500)
+        parser.add_argument('--bodies', type=int, default=5, help="Distinct message bodies (broadcast-style traffic).")
+        parser.add_argument('--latency', type=float, default=0.05, help="Stub response delay in seconds.")
+        parser.add_argument('--workers', type=int, default=8)
+
+    def handle(self, *args, **options):
+        StubHandler.latency = options['latency']
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        original_url = sms.SMS_API_URL
+        sms.SMS_API_URL = f"http://127.0.0.1:{server.server_port}/v1/sms/send"
+        try:
+            for grouped in (False, True):
+                self.run(grouped, options)
+        finally:
+            sms.SMS_API_URL = original_url
+            server.shutdown()
+        for name, stats in latency_stats.snapshot().items():
+            self.stdout.write(f"{name}: {stats['count']} calls, avg {stats['avg_ms']:.1f} ms, max {stats['max_ms']:.1f} ms, {stats['errors']} errors")
+
+    def run(self, grouped, options):
+        StubHandler.requests = 0
+        try:
+            with transaction.atomic():
+                users = User.objects.bulk_create(
+                    User(name=f'Bench {i}', role='farmer', phone_number=f'2547990{i:05d}') for i in range(options['messages'])
+                )
+                for i in range(options['bodies']):
+                    queue_bulk_sms(users[i::options['bodies']], f"Market update {i}: maize prices changed.")
+                start = time.perf_counter()
+                while drain_outbox(batch_size=500, workers=options['workers'], grouped=grouped):
+                    pass
+                elapsed = time.perf_counter() - start
+                sent = SMSOutbox.objects.filter(status='sent').count()
+                raise _Rollback
+        except _Rollback:
+            pass
+        mode = 'grouped' if grouped else 'per-message'
+        self.stdout.write(f"{mode}: {sent} messages in {elapsed:.2f}s ({sent / elapsed:.0f} msg/s), {StubHandler.requests} HTTP requests")
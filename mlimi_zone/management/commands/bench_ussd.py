@@ -0,0 +1,76 @@
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from mlimi_zone.caching import bump_version
+from mlimi_zone.models import User, Crop, MarketPrice, ProduceListing
+from mlimi_zone.ussd import USSDView
+
+FARMER_PHONE = '254700000001'
+WHOLESALER_PHONE = '254700000002'
+NEW_PHONE = '254700000003'
+
+# Each script is a list of cumulative `text` values as the aggregator sends them.
+# None of the hops below trigger SMS or M-Pesa calls.
+SCRIPTS = {
+    'farmer': (FARMER_PHONE, ['', '1', '1*1', '1*1*0', '1*1*0*0', '1*1*0*0*2', '1*1*0*0*2*1', '1*1*0*0*2*1*00']),
+    'wholesaler': (WHOLESALER_PHONE, ['', '1', '1*2', '1*2*0', '1*2*0*0', '1*2*0*0*2', '1*2*0*0*2*2', '1*2*0*0*2*2*1', '1*2*0*0*2*2*1*0', '1*2*0*0*2*2*1*0*00']),
+    'registration': (NEW_PHONE, ['', '1']),
+}
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Measure per-hop CPU time of the USSD menus against a throwaway dataset."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=200)
+        parser.add_argument('--listings', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options['listings'])
+                for name, (phone, script) in SCRIPTS.items():
+                    self.run_script(name, phone, script, options['rounds'])
+                raise _Rollback
+        except _Rollback:
+            pass
+        # Menus rendered from the rolled-back seed data must not outlive it.
+        bump_version('marketprice')
+        bump_version('crop')
+
+    def seed(self, listings):
+        crops = {name: Crop.objects.get_or_create(crop_name=name)[0] for name in ['Maize', 'Peas', 'Rice', 'Ground nuts']}
+        for crop in crops.values():
+            for region in ['Southern Region', 'Central Region', 'Northern Region']:
+                MarketPrice.objects.update_or_create(crop=crop, location=region, defaults={'price_per_unit': Decimal('500')})
+        farmer = User.objects.create(name='Bench Farmer', role='farmer', location='Blantyre', phone_number=FARMER_PHONE)
+        User.objects.create(name='Bench Wholesaler', role='wholesaler', location='Lilongwe', phone_number=WHOLESALER_PHONE)
+        User.objects.filter(phone_number=NEW_PHONE).delete()
+        ProduceListing.objects.bulk_create(
+            ProduceListing(farmer=farmer, crop=crops['Peas'], quantity=Decimal('100')) for _ in range(listings)
+        )
+
+    def run_script(self, name, phone, script, rounds):
+        factory = RequestFactory()
+        view = USSDView.as_view()
+        hops = 0
+        cpu = 0.0
+        wall = 0.0
+        for i in range(rounds):
+            session_id = f'bench-{name}-{i}'
+            for text in script:
+                request = factory.post('/mlimi_zone/ussd/', {
+                    'sessionId': session_id, 'serviceCode': '*384#', 'phoneNumber': phone, 'text': text,
+                })
+                cpu_start, wall_start = time.process_time(), time.perf_counter()
+                view(request)
+                cpu += time.process_time() - cpu_start
+                wall += time.perf_counter() - wall_start
+                hops += 1
+        self.stdout.write(f"{name}: {hops} hops, {cpu / hops * 1000:.3f} ms CPU/hop, {wall / hops * 1000:.3f} ms wall/hop")
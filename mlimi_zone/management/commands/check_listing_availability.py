@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from mlimi_zone.models import ProduceListing
+
+
+class Command(BaseCommand):
+    help = "Report listings whose is_available flag disagrees with their orders; exits non-zero if any do."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help="How many mismatched listings to print.")
+
+    def handle(self, *args, **options):
+        mismatched = ProduceListing.objects.inconsistent().order_by('croplisting_id')
+        count = mismatched.count()
+        if not count:
+            self.stdout.write(self.style.SUCCESS("All listing availability flags match their orders."))
+            return
+        for croplisting_id, is_available in mismatched.values_list('croplisting_id', 'is_available')[:options['limit']]:
+            state = 'available but booked' if is_available else 'unavailable but not booked'
+            self.stdout.write(f"Listing {croplisting_id}: {state}")
+        raise CommandError(f"{count} listings have a stale availability flag; run backfill_listing_availability.")
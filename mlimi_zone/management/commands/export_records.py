@@ -0,0 +1,38 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from mlimi_zone.exports import CHUNK_SIZE, EXPORTS, FORMATS, ExportError, export_lines
+
+
+class Command(BaseCommand):
+    help = "Stream orders, payments or SMS logs as CSV or NDJSON without loading the table into memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=list(EXPORTS))
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--since', help="Inclusive start, YYYY-MM-DD or ISO datetime.")
+        parser.add_argument('--until', help="Exclusive end; a bare date includes that whole day.")
+        parser.add_argument('--status')
+        parser.add_argument('--output', default='-', help="File to write, or - for stdout.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            lines = export_lines(
+                options['name'], options['format'], options['since'], options['until'],
+                options['status'], options['chunk_size'],
+            )
+        except ExportError as e:
+            raise CommandError(str(e))
+        if options['output'] == '-':
+            self.write_lines(sys.stdout, lines)
+        else:
+            try:
+                with open(options['output'], 'w', encoding='utf-8', newline='') as stream:
+                    self.write_lines(stream, lines)
+            except OSError as e:
+                raise CommandError(f"Cannot write {options['output']}: {e}")
+        self.stderr.write(f"Exported {options['name']}.")
+
+    def write_lines(self, stream, lines):
+        for chunk in lines:
+            stream.write(chunk)
@@ -0,0 +1,31 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from mlimi_zone.price_import import CHUNK_SIZE, import_prices, iter_price_rows, text_stream
+
+
+class Command(BaseCommand):
+    help = "Stream a CSV or JSON (array or JSON Lines) price sheet into MarketPrice, upserting on (crop, location)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin.")
+        parser.add_argument('--format', choices=['csv', 'json'], help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'json')
+
+        def report(number, message):
+            self.stderr.write(f"Row {number}: {message}")
+
+        if path == '-':
+            result = import_prices(iter_price_rows(text_stream(sys.stdin.buffer), file_format), options['chunk_size'], report)
+        else:
+            try:
+                with open(path, encoding='utf-8-sig', newline='') as stream:
+                    result = import_prices(iter_price_rows(stream, file_format), options['chunk_size'], report)
+            except OSError as e:
+                raise CommandError(f"Cannot read {path}: {e}")
+        self.stdout.write(f"{result['rows']} rows read, {result['upserted']} prices upserted, {result['failed']} rejected.")
+        if result['failed']:
+            raise CommandError(f"{result['failed']} rows were rejected.")
@@ -0,0 +1,27 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from mlimi_zone.payments import queued_payment_ids, run_stk_push
+
+
+class Command(BaseCommand):
+    help = "Send STK pushes for queued payments the web workers did not pick up, and retry claims abandoned by a dead worker."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=30.0, help="Only take intents queued at least this many seconds ago.")
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--interval', type=float, default=0.0, help="Keep polling every N seconds; 0 runs once.")
+
+    def handle(self, *args, **options):
+        older_than = timedelta(seconds=options['older_than'])
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                ids = list(queued_payment_ids(older_than))
+                started = sum(1 for ok in pool.map(run_stk_push, ids) if ok)
+                self.stdout.write(f"Processed {len(ids)} queued payments, {started} STK pushes accepted.")
+                if not options['interval']:
+                    break
+                close_old_connections()
+                time.sleep(options['interval'])
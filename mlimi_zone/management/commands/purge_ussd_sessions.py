@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from mlimi_zone.models import USSDSession
+
+
+class Command(BaseCommand):
+    help = "Delete expired USSD sessions in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches.")
+
+    def handle(self, *args, **options):
+        deleted = USSDSession.objects.purge_expired(batch_size=options['batch_size'], pause=options['pause'])
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} expired USSD sessions."))
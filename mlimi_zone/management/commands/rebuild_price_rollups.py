@@ -0,0 +1,23 @@
+from datetime import datetime, time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from mlimi_zone.price_history import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute daily and weekly MarketPriceRollup rows from MarketPriceHistory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="YYYY-MM-DD; rebuild from the start of that week only.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            day = parse_date(options['since'])
+            if day is None:
+                raise CommandError("--since must be YYYY-MM-DD.")
+            since = datetime.combine(day, time.min, tzinfo=timezone.get_current_timezone())
+        buckets = rebuild_rollups(since=since, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {buckets} price rollups."))
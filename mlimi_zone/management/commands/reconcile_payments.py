@@ -0,0 +1,26 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from mlimi_zone.payments import reconcile_pending_payments
+
+
+class Command(BaseCommand):
+    help = "Query Daraja for payments stuck in 'pending' without a callback and apply the final results in bulk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=600.0, help="Only check payments pending at least this many seconds.")
+        parser.add_argument('--chunk-size', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent STK query requests.")
+        parser.add_argument('--interval', type=float, default=0.0, help="Keep reconciling every N seconds; 0 runs once.")
+
+    def handle(self, *args, **options):
+        while True:
+            checked, completed, failed = reconcile_pending_payments(
+                timedelta(seconds=options['older_than']), options['chunk_size'], options['workers']
+            )
+            self.stdout.write(f"Checked {checked} stale payments: {completed} completed, {failed} failed, {checked - completed - failed} still pending.")
+            if not options['interval']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
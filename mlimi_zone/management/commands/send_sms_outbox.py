@@ -0,0 +1,33 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from mlimi_zone.httpclient import latency_stats
+from mlimi_zone.outbox import drain_outbox, MAX_ATTEMPTS
+
+
+class Command(BaseCommand):
+    help = "Deliver queued SMS from the outbox, retrying failures with backoff."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent HTTP sends per batch.")
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds to idle when the outbox is empty.")
+        parser.add_argument('--once', action='store_true', help="Drain what is due now and exit.")
+        parser.add_argument('--no-group', action='store_true', help="Send one request per message instead of one per distinct body.")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            sent = drain_outbox(options['batch_size'], options['workers'], options['max_attempts'], grouped=not options['no_group'])
+            total += sent
+            if sent:
+                continue
+            if options['once']:
+                break
+            close_old_connections()
+            time.sleep(options['interval'])
+        stats = latency_stats.snapshot().get('smsleopard.send')
+        if stats:
+            self.stdout.write(f"SMSLeopard: {stats['count']} calls, avg {stats['avg_ms']:.1f} ms, max {stats['max_ms']:.1f} ms, {stats['errors']} errors")
+        self.stdout.write(self.style.SUCCESS(f"Processed {total} outbox messages."))
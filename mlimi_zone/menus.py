@@ -0,0 +1,177 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+import logging
+
+logger = logging.getLogger(__name__)
+
+BACK = '0'
+MAIN_MENU = '00'
+MORE = '98'
+NAV_FOOTER = "0. Back\n00. Main menu"
+MORE_FOOTER = f"{MORE}. More\n{NAV_FOOTER}"
+PAGE_FETCH_SIZE = 10
+
+
+def max_response_chars():
+    return getattr(settings, 'USSD_MAX_RESPONSE_CHARS', 182)
+
+
+class State:
+    def __init__(self, name, text=None, options=(), render=None, handle=None,
+                 invalid="Invalid option.", footer=True, navigable=True, paged=False):
+        self.name = name
+        self.text = text
+        self.options = tuple(options)
+        self.targets = {key: target for key, _, target in self.options}
+        self.invalid = invalid
+        self.footer = footer
+        self.navigable = navigable
+        self.paged = paged
+        self._render = render
+        self._handle = handle
+        if render is None:
+            lines = [text] + [f"{key}. {label}" for key, label, _ in self.options]
+            if footer:
+                lines.append(NAV_FOOTER)
+            self.body = "\n".join(lines)
+
+    def render(self, ctx):
+        if self._render:
+            return self._render(ctx)
+        return ctx.con(self.body)
+
+    def handle(self, ctx, choice):
+        if self._handle:
+            return self._handle(ctx, choice)
+        target = self.targets.get(choice)
+        if target is None:
+            return ctx.end(self.invalid)
+        return ctx.goto(target)
+
+
+class Menu:
+    def __init__(self, name, root, states):
+        self.name = name
+        self.root = root
+        self.states = {}
+        for state in states:
+            if state.name in self.states:
+                raise ImproperlyConfigured(f"Duplicate USSD state '{state.name}' in menu '{name}'")
+            self.states[state.name] = state
+        if root not in self.states:
+            raise ImproperlyConfigured(f"Root state '{root}' missing from menu '{name}'")
+        for state in self.states.values():
+            for target in state.targets.values():
+                if target not in self.states:
+                    raise ImproperlyConfigured(f"State '{state.name}' in menu '{name}' points at unknown state '{target}'")
+
+    def initial_data(self):
+        return {'level': self.root, 'previous_levels': []}
+
+    def render(self, name, ctx):
+        return self.states[name].render(ctx)
+
+    def run(self, ctx):
+        if not ctx.text:
+            ctx.reset()
+            return self.render(self.root, ctx)
+        state = self.states.get(ctx.level)
+        if state is None:
+            logger.error(f"Invalid session level: {ctx.level} for session {ctx.session_id}")
+            return ctx.end("Invalid session state.")
+        if state.paged:
+            if ctx.input == MORE and ctx.data.get('next_page') is not None:
+                ctx.data['pages'].append(ctx.data['next_page'])
+                return state.render(ctx)
+            if ctx.input == BACK and len(ctx.data.get('pages') or []) > 1:
+                ctx.data['pages'].pop()
+                return state.render(ctx)
+        if state.navigable:
+            if ctx.input == BACK:
+                return ctx.back()
+            if ctx.input == MAIN_MENU:
+                ctx.reset()
+                return self.render(self.root, ctx)
+        return state.handle(ctx, ctx.input)
+
+
+class MenuContext:
+    def __init__(self, menu, session_id, phone_number, text, data, user=None):
+        self.menu = menu
+        self.session_id = session_id
+        self.phone_number = phone_number
+        self.text = text
+        self.inputs = text.split('*') if text else ['']
+        self.input = self.inputs[-1].strip()
+        self.data = data or menu.initial_data()
+        self.user = user
+        self.finished = False
+
+    @property
+    def level(self):
+        return self.data.get('level', self.menu.root)
+
+    def con(self, body):
+        return f"CON {body}"
+
+    def end(self, body):
+        self.finished = True
+        return f"END {body}"
+
+    def goto(self, name):
+        if name not in self.menu.states:
+            raise ImproperlyConfigured(f"Unknown USSD state '{name}' in menu '{self.menu.name}'")
+        self.data.setdefault('previous_levels', []).append(self.level)
+        self.data['level'] = name
+        if self.menu.states[name].paged:
+            self.data['pages'] = [None]
+            self.data.pop('next_page', None)
+        return self.menu.render(name, self)
+
+    def back(self):
+        stack = self.data.get('previous_levels') or []
+        self.data['level'] = stack.pop() if stack else self.menu.root
+        self.data['previous_levels'] = stack
+        return self.menu.render(self.data['level'], self)
+
+    def reset(self, name=None, stack=()):
+        self.data['level'] = name or self.menu.root
+        self.data['previous_levels'] = list(stack)
+        self.data.pop('pages', None)
+        self.data.pop('next_page', None)
+
+    @property
+    def page_cursor(self):
+        pages = self.data.get('pages')
+        return pages[-1] if pages else None
+
+    def paginate(self, queryset, key, header, format_row):
+        # Keyset page: rows after the cursor in `key` order, trimmed to what fits
+        # on one screen. Only the page-start stack and next cursor are kept in
+        # the session; callers store whatever per-row ids they need.
+        cursor = self.page_cursor
+        if cursor is not None:
+            queryset = queryset.filter(**{f'{key}__gt': cursor})
+        rows = list(queryset.order_by(key)[:PAGE_FETCH_SIZE + 1])
+        budget = max_response_chars() - len("CON ") - len(header) - len(MORE_FOOTER) - 1
+        shown, lines = [], []
+        for row in rows[:PAGE_FETCH_SIZE]:
+            line = f"{len(shown) + 1}. {format_row(row)}"
+            if shown and budget - len(line) - 1 < 0:
+                break
+            budget -= len(line) + 1
+            shown.append(row)
+            lines.append(line)
+        has_more = len(shown) < len(rows)
+        if has_more:
+            self.data['next_page'] = getattr(shown[-1], key)
+        else:
+            self.data.pop('next_page', None)
+        body = "\n".join([header, *lines, MORE_FOOTER if has_more else NAV_FOOTER])
+        return shown, self.con(body)
+
+    def switch(self, menu, user=None):
+        self.menu = menu
+        self.user = user or self.user
+        self.data = menu.initial_data()
+        return menu.render(menu.root, self)
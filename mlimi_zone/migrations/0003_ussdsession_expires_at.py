@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:04
+
+import mlimi_zone.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mlimi_zone", "0002_ussdsession"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ussdsession",
+            name="expires_at",
+            field=models.DateTimeField(
+                db_index=True, default=mlimi_zone.models.ussd_session_expiry
+            ),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mlimi_zone", "0004_smsoutbox"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="payment",
+            name="payment_status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("initiating", "Initiating"),
+                    ("pending", "Pending"),
+                    ("completed", "Completed"),
+                    ("failed", "Failed"),
+                ],
+                max_length=20,
+            ),
+        ),
+    ]
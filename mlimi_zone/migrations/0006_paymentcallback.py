@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mlimi_zone", "0005_payment_status_queued"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentCallback",
+            fields=[
+                ("callback_id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("body", models.JSONField()),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "applied_at",
+                    models.DateTimeField(blank=True, db_index=True, null=True),
+                ),
+            ],
+        ),
+    ]
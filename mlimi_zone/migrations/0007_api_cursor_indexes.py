@@ -0,0 +1,43 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mlimi_zone", "0006_paymentcallback"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="cart",
+            index=models.Index(
+                fields=["created_at", "cart_id"], name="cart_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="marketprice",
+            index=models.Index(
+                fields=["created_at", "market_price_id"], name="marketprice_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["created_at", "order_id"], name="order_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["created_at", "payment_id"], name="payment_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="producelisting",
+            index=models.Index(
+                fields=["created_at", "croplisting_id"], name="listing_created_idx"
+            ),
+        ),
+    ]
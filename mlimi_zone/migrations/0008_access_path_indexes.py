@@ -0,0 +1,90 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def drop_duplicate_prices(apps, schema_editor):
+    # Keep the most recently updated price for each (crop, location).
+    MarketPrice = apps.get_model("mlimi_zone", "MarketPrice")
+    seen = set()
+    duplicates = []
+    for price_id, crop_id, location in MarketPrice.objects.order_by(
+        "crop_id", "location", "-updated_at", "-market_price_id"
+    ).values_list("market_price_id", "crop_id", "location"):
+        if (crop_id, location) in seen:
+            duplicates.append(price_id)
+        seen.add((crop_id, location))
+    MarketPrice.objects.filter(market_price_id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mlimi_zone", "0007_api_cursor_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["wholesaler", "status", "order_id"],
+                name="order_wholesaler_status_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="producelisting",
+            index=models.Index(
+                fields=["crop", "croplisting_id"], name="listing_crop_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="smslogs",
+            index=models.Index(fields=["user", "sent_at"], name="smslog_user_sent_idx"),
+        ),
+        migrations.RunPython(drop_duplicate_prices, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="marketprice",
+            constraint=models.UniqueConstraint(
+                fields=("crop", "location"), name="marketprice_crop_location_uniq"
+            ),
+        ),
+        migrations.AlterField(
+            model_name="marketprice",
+            name="crop",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="mlimi_zone.crop",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="order",
+            name="wholesaler",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="orders",
+                to="mlimi_zone.user",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="producelisting",
+            name="crop",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="mlimi_zone.crop",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="smslogs",
+            name="user",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="sms_logs",
+                to="mlimi_zone.user",
+            ),
+        ),
+    ]
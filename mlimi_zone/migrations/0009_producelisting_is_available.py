@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:19
+
+from django.db import migrations, models
+
+
+def mark_booked_listings(apps, schema_editor):
+    # One statement; backfill_listing_availability repairs in chunks if needed.
+    ProduceListing = apps.get_model("mlimi_zone", "ProduceListing")
+    Order = apps.get_model("mlimi_zone", "Order")
+    ProduceListing.objects.filter(
+        croplisting_id__in=Order.objects.values("croplisting_id")
+    ).update(is_available=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mlimi_zone", "0008_access_path_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="producelisting",
+            name="is_available",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.RunPython(mark_booked_listings, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="producelisting",
+            index=models.Index(
+                condition=models.Q(("is_available", True)),
+                fields=["crop", "croplisting_id"],
+                name="listing_available_idx",
+            ),
+        ),
+    ]
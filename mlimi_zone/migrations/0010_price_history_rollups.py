@@ -0,0 +1,129 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:33
+
+from datetime import timedelta
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def seed_history(apps, schema_editor):
+    # Current prices become the first point of each series; older values were
+    # overwritten and cannot be recovered.
+    MarketPrice = apps.get_model("mlimi_zone", "MarketPrice")
+    MarketPriceHistory = apps.get_model("mlimi_zone", "MarketPriceHistory")
+    MarketPriceRollup = apps.get_model("mlimi_zone", "MarketPriceRollup")
+    history, rollups = [], []
+    for crop_id, location, price, updated_at in MarketPrice.objects.values_list(
+        "crop_id", "location", "price_per_unit", "updated_at"
+    ).iterator():
+        history.append(
+            MarketPriceHistory(
+                crop_id=crop_id,
+                location=location,
+                price_per_unit=price,
+                recorded_at=updated_at,
+            )
+        )
+        day = django.utils.timezone.localdate(updated_at)
+        for period, start in (
+            ("day", day),
+            ("week", day - timedelta(days=day.weekday())),
+        ):
+            rollups.append(
+                MarketPriceRollup(
+                    crop_id=crop_id,
+                    location=location,
+                    period=period,
+                    period_start=start,
+                    min_price=price,
+                    max_price=price,
+                    total_price=price,
+                    samples=1,
+                )
+            )
+    MarketPriceHistory.objects.bulk_create(history, batch_size=1000)
+    MarketPriceRollup.objects.bulk_create(rollups, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mlimi_zone", "0009_producelisting_is_available"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MarketPriceHistory",
+            fields=[
+                ("history_id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("location", models.CharField(max_length=20)),
+                (
+                    "price_per_unit",
+                    models.DecimalField(decimal_places=2, max_digits=10),
+                ),
+                (
+                    "recorded_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "crop",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="mlimi_zone.crop",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["crop", "location", "recorded_at"],
+                        name="pricehistory_series_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="MarketPriceRollup",
+            fields=[
+                ("rollup_id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("location", models.CharField(max_length=20)),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[("day", "Daily"), ("week", "Weekly")], max_length=4
+                    ),
+                ),
+                ("period_start", models.DateField()),
+                ("min_price", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("max_price", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("total_price", models.DecimalField(decimal_places=2, max_digits=18)),
+                ("samples", models.PositiveIntegerField()),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "crop",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="mlimi_zone.crop",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["crop", "period", "period_start"],
+                        name="pricerollup_crop_period_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("crop", "location", "period", "period_start"),
+                        name="pricerollup_bucket_uniq",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(seed_history, migrations.RunPython.noop),
+    ]
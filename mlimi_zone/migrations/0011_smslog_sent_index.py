@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mlimi_zone", "0010_price_history_rollups"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="smslogs",
+            index=models.Index(fields=["sent_at", "smslog_id"], name="smslog_sent_idx"),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("mlimi_zone", "0011_smslog_sent_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="claimed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,11 @@
-from django.db import models
+from datetime import timedelta
+from decimal import Decimal
+import time
+from django.conf import settings
+from django.db import models, transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
 ROLE_CHOICES = (
     ('farmer', 'Farmer'),
@@ -12,6 +17,9 @@ ORDER_STATUS_CHOICES = [
     ('paid', 'Paid')
 ]
 PAYMENT_STATUS_CHOICES = (
+    ('queued', 'Queued'),
+    ('initiating', 'Initiating'),
+    ('pending', 'Pending'),
     ('completed', 'Completed'),
     ('failed', 'Failed'),
 )
@@ -19,6 +27,29 @@ SMS_STATUS_CHOICES = (
     ('delivered', 'Delivered'),
     ('failed', 'Failed'),
 )
+# Districts users register with -> the region MarketPrice rows are kept for.
+DISTRICT_TO_REGION = {
+    'Blantyre': 'Southern Region', 'Zomba': 'Southern Region', 'Mulanje': 'Southern Region',
+    'Thyolo': 'Southern Region', 'Chiradzulu': 'Southern Region', 'Nsanje': 'Southern Region',
+    'Chikwawa': 'Southern Region', 'Phalombe': 'Southern Region', 'Mwanza': 'Southern Region',
+    'Balaka': 'Southern Region', 'Mangochi': 'Southern Region', 'Machinga': 'Southern Region',
+    'Neno': 'Southern Region',
+    'Lilongwe': 'Central Region', 'Salima': 'Central Region', 'Dowa': 'Central Region',
+    'Ntchisi': 'Central Region', 'Nkhotakota': 'Central Region', 'Kasungu': 'Central Region',
+    'Mchinji': 'Central Region', 'Dedza': 'Central Region', 'Ntcheu': 'Central Region',
+    'Mzimba': 'Northern Region', 'Karonga': 'Northern Region', 'Chitipa': 'Northern Region',
+    'Rumphi': 'Northern Region', 'Nkhata Bay': 'Northern Region', 'Likoma': 'Northern Region'
+}
+PRICE_ROLLUP_PERIOD_CHOICES = (
+    ('day', 'Daily'),
+    ('week', 'Weekly'),
+)
+SMS_OUTBOX_STATUS_CHOICES = (
+    ('pending', 'Pending'),
+    ('sending', 'Sending'),
+    ('sent', 'Sent'),
+    ('failed', 'Failed'),
+)
 
 def normalize_phone(phone):
     if not phone:
@@ -44,12 +75,49 @@ class Crop(models.Model):
     def __str__(self):
         return self.crop_name
 
+class ProduceListingQuerySet(models.QuerySet):
+    def available(self):
+        return self.filter(is_available=True)
+
+    def inconsistent(self):
+        # Listings whose is_available flag disagrees with whether an order exists.
+        booked = models.Exists(Order.objects.filter(croplisting=models.OuterRef('pk')))
+        return self.alias(booked=booked).filter(
+            models.Q(is_available=True, booked=True) | models.Q(is_available=False, booked=False)
+        )
+
+    def sync_availability(self, batch_size=1000, pause=0):
+        # Recomputes the flag in croplisting_id chunks; returns how many rows changed.
+        changed = 0
+        last_id = 0
+        while True:
+            batch = list(self.filter(croplisting_id__gt=last_id).order_by('croplisting_id').values_list('croplisting_id', flat=True)[:batch_size])
+            if not batch:
+                return changed
+            last_id = batch[-1]
+            booked = Order.objects.filter(croplisting_id__in=batch).values('croplisting_id')
+            with transaction.atomic():
+                changed += self.filter(croplisting_id__in=booked, is_available=True).update(is_available=False)
+                changed += self.filter(croplisting_id__in=batch, is_available=False).exclude(croplisting_id__in=booked).update(is_available=True)
+            if pause:
+                time.sleep(pause)
+
 class ProduceListing(models.Model):
     croplisting_id = models.AutoField(primary_key=True)
     farmer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='produce_listings')
-    crop = models.ForeignKey(Crop, on_delete=models.CASCADE)
+    crop = models.ForeignKey(Crop, on_delete=models.CASCADE, db_index=False)
     quantity = models.DecimalField(max_digits=10, decimal_places=2)
+    # False once an order holds the listing; kept in step by signals.mark_listing_*.
+    is_available = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    objects = ProduceListingQuerySet.as_manager()
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'croplisting_id'], name='listing_created_idx'),
+            models.Index(fields=['crop', 'croplisting_id'], name='listing_crop_idx'),
+            # Open listings for a crop, walked in croplisting_id order by the USSD menu.
+            models.Index(fields=['crop', 'croplisting_id'], condition=models.Q(is_available=True), name='listing_available_idx'),
+        ]
     def __str__(self):
         return f"{self.quantity} of {self.crop.crop_name} by {self.farmer.name}"
 
@@ -58,18 +126,25 @@ class Cart(models.Model):
     wholesaler = models.OneToOneField(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    class Meta:
+        indexes = [models.Index(fields=['created_at', 'cart_id'], name='cart_created_idx')]
     def __str__(self):
         return f"Cart for {self.wholesaler.name}"
 
 class Order(models.Model):
     order_id = models.AutoField(primary_key=True)
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='orders')
-    wholesaler = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
+    wholesaler = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders', db_index=False)
     croplisting = models.OneToOneField(ProduceListing, on_delete=models.CASCADE)
     price = models.DecimalField(max_digits=12, decimal_places=2, null=False, blank=False)
     status = models.CharField(max_length=10, choices=ORDER_STATUS_CHOICES, default='unpaid')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'order_id'], name='order_created_idx'),
+            models.Index(fields=['wholesaler', 'status', 'order_id'], name='order_wholesaler_status_idx'),
+        ]
     def __str__(self):
         return f"Order {self.order_id} by {self.wholesaler.name}"
 
@@ -79,34 +154,131 @@ class Payment(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES)
     transaction_ref = models.CharField(max_length=50, unique=True, null=True, blank=True)
+    # When a runner moved the payment to 'initiating'; an old claim means the runner died.
+    claimed_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        indexes = [models.Index(fields=['created_at', 'payment_id'], name='payment_created_idx')]
     def __str__(self):
         return f"Payment {self.payment_id} for Order {self.order.order_id}"
 
+class PaymentCallback(models.Model):
+    callback_id = models.BigAutoField(primary_key=True)
+    body = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    applied_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    def __str__(self):
+        return f"M-Pesa callback {self.callback_id} received {self.received_at}"
+
 class MarketPrice(models.Model):
     market_price_id = models.AutoField(primary_key=True)
-    crop = models.ForeignKey(Crop, on_delete=models.CASCADE)
+    crop = models.ForeignKey(Crop, on_delete=models.CASCADE, db_index=False)
     location = models.CharField(max_length=20)
     price_per_unit = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    class Meta:
+        indexes = [models.Index(fields=['created_at', 'market_price_id'], name='marketprice_created_idx')]
+        # One current price per crop and region; also serves lookups by crop alone.
+        constraints = [models.UniqueConstraint(fields=['crop', 'location'], name='marketprice_crop_location_uniq')]
     def __str__(self):
         return f"{self.crop.crop_name} price in {self.location}"
 
+class MarketPriceHistory(models.Model):
+    history_id = models.BigAutoField(primary_key=True)
+    crop = models.ForeignKey(Crop, on_delete=models.CASCADE, db_index=False)
+    location = models.CharField(max_length=20)
+    price_per_unit = models.DecimalField(max_digits=10, decimal_places=2)
+    recorded_at = models.DateTimeField(default=timezone.now)
+    class Meta:
+        indexes = [models.Index(fields=['crop', 'location', 'recorded_at'], name='pricehistory_series_idx')]
+    def __str__(self):
+        return f"{self.crop.crop_name} in {self.location}: {self.price_per_unit} at {self.recorded_at}"
+
+class MarketPriceRollup(models.Model):
+    rollup_id = models.BigAutoField(primary_key=True)
+    crop = models.ForeignKey(Crop, on_delete=models.CASCADE, db_index=False)
+    location = models.CharField(max_length=20)
+    period = models.CharField(max_length=4, choices=PRICE_ROLLUP_PERIOD_CHOICES)
+    period_start = models.DateField()
+    min_price = models.DecimalField(max_digits=10, decimal_places=2)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2)
+    total_price = models.DecimalField(max_digits=18, decimal_places=2)
+    samples = models.PositiveIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+    class Meta:
+        # The unique key serves per-region series; the index serves a crop across all regions.
+        indexes = [models.Index(fields=['crop', 'period', 'period_start'], name='pricerollup_crop_period_idx')]
+        constraints = [
+            models.UniqueConstraint(fields=['crop', 'location', 'period', 'period_start'], name='pricerollup_bucket_uniq'),
+        ]
+    @property
+    def avg_price(self):
+        return (self.total_price / self.samples).quantize(Decimal('0.01'))
+    def __str__(self):
+        return f"{self.crop.crop_name} in {self.location}, {self.period} of {self.period_start}"
+
 class SMSLogs(models.Model):
     smslog_id = models.AutoField(primary_key=True)
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sms_logs')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sms_logs', db_index=False)
     message_body = models.TextField()
     sent_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=10, choices=SMS_STATUS_CHOICES)
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'sent_at'], name='smslog_user_sent_idx'),
+            models.Index(fields=['sent_at', 'smslog_id'], name='smslog_sent_idx'),
+        ]
     def __str__(self):
         return f"SMS to {self.user.name} at {self.sent_at}"
 
+class SMSOutbox(models.Model):
+    sms_id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sms_outbox')
+    message_body = models.TextField()
+    status = models.CharField(max_length=10, choices=SMS_OUTBOX_STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+    def __str__(self):
+        return f"Outbox SMS {self.sms_id} to {self.user.name} ({self.status})"
+
+def ussd_session_ttl():
+    return getattr(settings, 'USSD_SESSION_STORE', {}).get('TTL', 180)
+
+def ussd_session_expiry():
+    return timezone.now() + timedelta(seconds=ussd_session_ttl())
+
+class USSDSessionQuerySet(models.QuerySet):
+    def live(self):
+        return self.filter(expires_at__gt=timezone.now())
+
+    def expired(self, now=None):
+        return self.filter(expires_at__lte=now or timezone.now())
+
+    def purge_expired(self, batch_size=1000, now=None, pause=0):
+        # Small keyed batches keep each DELETE (and its locks) short.
+        now = now or timezone.now()
+        deleted = 0
+        while True:
+            batch = list(self.expired(now).order_by('expires_at').values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                return deleted
+            deleted += self.filter(pk__in=batch).delete()[0]
+            if pause:
+                time.sleep(pause)
+
 class USSDSession(models.Model):
     session_id = models.CharField(max_length=100, unique=True)
     phone_number = models.CharField(max_length=15)
     data = models.JSONField(default=dict)
     created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(default=ussd_session_expiry, db_index=True)
+    objects = USSDSessionQuerySet.as_manager()
     def __str__(self):
         return f"USSD Session {self.session_id} for {self.phone_number}"
 
@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.db import transaction
+from django.utils import timezone
+from .models import SMSOutbox, SMSLogs
+from .sms import send_bulk_sms, MAX_DESTINATIONS
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 60 * 60
+# A claimed row whose worker died becomes claimable again after this long.
+CLAIM_LEASE = timedelta(minutes=5)
+
+
+def queue_sms(user, message_body):
+    return SMSOutbox.objects.create(user=user, message_body=message_body)
+
+
+def queue_bulk_sms(users, message_body):
+    return SMSOutbox.objects.bulk_create(SMSOutbox(user=user, message_body=message_body) for user in users)
+
+
+FAILED_RECIPIENT_STATUSES = {'failed', 'rejected', 'invalid', 'error', 'undelivered'}
+
+
+def phone_digits(number):
+    return ''.join(ch for ch in str(number) if ch.isdigit())
+
+
+def recipient_outcomes(response, numbers):
+    # send_bulk_sms returns the provider body on HTTP 200 and a status_code/message
+    # dict otherwise. A 200 body lists one result per recipient; numbers missing
+    # from it, or reported failed, are retried on their own.
+    if not isinstance(response, dict):
+        raise ValueError(f"Unexpected SMS provider response: {response!r:.200}")
+    if response.get('status_code', 200) != 200 or response.get('success') is False:
+        error = f"{response.get('status_code', 200)}: {response.get('message')}"
+        return [(False, error) for _ in numbers]
+    recipients = response.get('recipients')
+    if not isinstance(recipients, list):
+        return [(True, '') for _ in numbers]
+    results = {
+        phone_digits(recipient.get('number')): recipient
+        for recipient in recipients if isinstance(recipient, dict)
+    }
+    outcomes = []
+    for number in numbers:
+        recipient = results.get(phone_digits(number))
+        if recipient is None:
+            outcomes.append((False, "No result for recipient in provider response"))
+            continue
+        status = str(recipient.get('status', '')).lower()
+        if status in FAILED_RECIPIENT_STATUSES or recipient.get('success') is False:
+            detail = recipient.get('message') or recipient.get('description')
+            outcomes.append((False, f"{status or 'failed'}: {detail}" if detail else status or 'failed'))
+        else:
+            outcomes.append((True, ''))
+    return outcomes
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+
+def claim_batch(batch_size):
+    now = timezone.now()
+    lease_until = now + CLAIM_LEASE
+    due = SMSOutbox.objects.filter(status__in=['pending', 'sending'], next_attempt_at__lte=now)
+    with transaction.atomic():
+        ids = list(due.select_for_update(skip_locked=True).order_by('next_attempt_at').values_list('sms_id', flat=True)[:batch_size])
+        if not ids:
+            return []
+        # Re-check due-ness so rows another worker claimed in the meantime stay theirs.
+        due.filter(sms_id__in=ids).update(status='sending', next_attempt_at=lease_until)
+    return list(SMSOutbox.objects.filter(sms_id__in=ids, status='sending', next_attempt_at=lease_until).select_related('user'))
+
+
+def group_by_body(messages):
+    groups = {}
+    for message in messages:
+        groups.setdefault(message.message_body, []).append(message)
+    for body, members in groups.items():
+        for start in range(0, len(members), MAX_DESTINATIONS):
+            yield members[start:start + MAX_DESTINATIONS]
+
+
+def deliver(group):
+    # One request per distinct body; returns one (delivered, error) per message.
+    numbers = [message.user.phone_number for message in group]
+    try:
+        return recipient_outcomes(send_bulk_sms(numbers, group[0].message_body), numbers)
+    except Exception as e:
+        return [(False, str(e)) for _ in group]
+
+
+def record_outcomes(results, max_attempts=MAX_ATTEMPTS):
+    now = timezone.now()
+    messages, logs = [], []
+    for message, (delivered, error) in results:
+        message.attempts += 1
+        message.last_error = error
+        if delivered:
+            message.status = 'sent'
+            message.sent_at = now
+        elif message.attempts >= max_attempts:
+            message.status = 'failed'
+        else:
+            message.status = 'pending'
+            message.next_attempt_at = now + retry_delay(message.attempts)
+        messages.append(message)
+        if message.status in ('sent', 'failed'):
+            logs.append(SMSLogs(
+                user=message.user,
+                message_body=message.message_body,
+                status='delivered' if delivered else 'failed'
+            ))
+    with transaction.atomic():
+        SMSOutbox.objects.bulk_update(messages, ['attempts', 'last_error', 'status', 'sent_at', 'next_attempt_at'])
+        SMSLogs.objects.bulk_create(logs)
+
+
+def drain_outbox(batch_size=100, workers=8, max_attempts=MAX_ATTEMPTS, grouped=True):
+    messages = claim_batch(batch_size)
+    if not messages:
+        return 0
+    groups = list(group_by_body(messages)) if grouped else [[message] for message in messages]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        outcomes = list(pool.map(deliver, groups))
+    results = []
+    for group, group_outcomes in zip(groups, outcomes):
+        failed = [error for delivered, error in group_outcomes if not delivered]
+        if failed:
+            logger.warning(f"SMS batch of {len(group)} (first id {group[0].sms_id}): {len(failed)} failed, e.g. {failed[0]}")
+        results.extend(zip(group, group_outcomes))
+    record_outcomes(results, max_attempts)
+    return len(messages)
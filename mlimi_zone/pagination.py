@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination
+from django.conf import settings
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    # Newest first; the primary key breaks ties between rows created in the
+    # same instant. Views without created_at set `cursor_ordering`.
+    ordering = ('-created_at', '-pk')
+    page_size_query_param = 'page_size'
+
+    @property
+    def max_page_size(self):
+        return getattr(settings, 'API_MAX_PAGE_SIZE', 500)
+
+    def get_ordering(self, request, queryset, view):
+        return getattr(view, 'cursor_ordering', self.ordering)
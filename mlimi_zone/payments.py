@@ -0,0 +1,259 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from .daraja import DarajaClient
+from .models import Payment, Order, PaymentCallback, SMSOutbox
+from .outbox import queue_sms
+import logging
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+# An 'initiating' claim older than this belongs to a runner that died before
+# recording the Daraja response; the payment may be pushed again.
+STK_PUSH_LEASE = timedelta(minutes=2)
+
+
+def expired_claim(now=None):
+    now = now or timezone.now()
+    return Q(payment_status='initiating') & (Q(claimed_at__isnull=True) | Q(claimed_at__lte=now - STK_PUSH_LEASE))
+
+
+def get_executor():
+    global _executor
+    workers = getattr(settings, 'STK_PUSH_WORKERS', 4)
+    if _executor is None and workers:
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stk-push')
+    return _executor
+
+
+def queue_payment(order):
+    # Must run inside the caller's transaction; returns None when a payment for
+    # the order is already queued, in flight or completed.
+    payment, created = Payment.objects.get_or_create(
+        order=order, defaults={'amount': order.price, 'payment_status': 'queued'}
+    )
+    if not created:
+        retried = Payment.objects.filter(Q(payment_status='failed') | expired_claim(), pk=payment.pk).update(
+            payment_status='queued', amount=order.price, transaction_ref=None, claimed_at=None
+        )
+        if not retried:
+            return None
+    transaction.on_commit(lambda: submit_stk_push(payment.pk))
+    return payment
+
+
+def submit_stk_push(payment_id):
+    executor = get_executor()
+    if executor:
+        executor.submit(run_stk_push, payment_id)
+
+
+def run_stk_push(payment_id):
+    try:
+        return initiate_stk_push(payment_id)
+    except Exception as e:
+        logger.error(f"STK push for payment {payment_id} crashed: {e}", exc_info=True)
+    finally:
+        close_old_connections()
+
+
+def initiate_stk_push(payment_id):
+    # The conditional update is the claim: only one runner moves a payment out
+    # of 'queued', or takes over an 'initiating' claim whose lease ran out.
+    claimed_at = timezone.now()
+    claimable = Q(payment_status='queued') | expired_claim(claimed_at)
+    if not Payment.objects.filter(claimable, pk=payment_id).update(payment_status='initiating', claimed_at=claimed_at):
+        return False
+    payment = Payment.objects.select_related(
+        'order__wholesaler', 'order__croplisting__crop', 'order__croplisting__farmer'
+    ).get(pk=payment_id)
+    order = payment.order
+    wholesaler = order.wholesaler
+    farmer = order.croplisting.farmer
+    crop_name = order.croplisting.crop.crop_name
+    try:
+        stk_response = DarajaClient().stk_push(
+            phone_number=wholesaler.phone_number,
+            amount=int(float(payment.amount)),
+            account_reference=f"Order_{order.order_id}",
+            transaction_desc=f"Payment for {crop_name}"
+        )
+    except Exception as e:
+        stk_response = {'error': str(e)}
+    logger.info(f"STK Push response for payment {payment_id}: {stk_response}")
+
+    # Only the current claim records a result; a runner whose lease was taken over stays quiet.
+    claim = Payment.objects.filter(pk=payment_id, payment_status='initiating', claimed_at=claimed_at)
+    with transaction.atomic():
+        if stk_response.get('ResponseCode') == '0':
+            if not claim.update(payment_status='pending', transaction_ref=stk_response['CheckoutRequestID']):
+                logger.warning(f"Claim on payment {payment_id} expired before the STK push returned")
+                return False
+            queue_sms(wholesaler, f"M-Pesa payment of {payment.amount} MWK for order {order.order_id} initiated. Check your phone.")
+            queue_sms(farmer, f"Payment of {payment.amount} MWK for {order.croplisting.quantity} KG of {crop_name} initiated by {wholesaler.name}.")
+            return True
+        error_message = stk_response.get('errorMessage') or stk_response.get('error', 'Unknown error')
+        logger.error(f"STK Push failed for payment {payment_id}: {error_message}")
+        if not claim.update(payment_status='failed'):
+            logger.warning(f"Claim on payment {payment_id} expired before the STK push returned")
+            return False
+        queue_sms(wholesaler, f"M-Pesa payment for order {order.order_id} could not be started: {error_message}. Please try again.")
+        return False
+
+
+def queued_payment_ids(older_than=timedelta(seconds=30)):
+    # Queued intents nobody picked up, plus claims abandoned by a dead runner.
+    now = timezone.now()
+    return Payment.objects.filter(
+        (Q(payment_status='queued') & Q(created_at__lte=now - older_than)) | expired_claim(now)
+    ).order_by('payment_id').values_list('payment_id', flat=True)
+
+
+def parse_stk_callback(body):
+    # The callback endpoint is unauthenticated, so any level may be missing or
+    # the wrong type; unusable bodies come back as (None, None, ...).
+    stk_callback = body.get('Body') if isinstance(body, dict) else None
+    stk_callback = stk_callback.get('stkCallback') if isinstance(stk_callback, dict) else None
+    if not isinstance(stk_callback, dict):
+        return None, None, 'Malformed callback'
+    checkout_id = stk_callback.get('CheckoutRequestID')
+    result_code = stk_callback.get('ResultCode')
+    if not isinstance(checkout_id, str) or not checkout_id or not isinstance(result_code, (int, str)):
+        return None, None, 'Malformed callback'
+    return checkout_id, result_code, str(stk_callback.get('ResultDesc', 'No description'))
+
+
+def callback_status(result_code):
+    return 'completed' if str(result_code) == '0' else 'failed'
+
+
+def confirmation_messages(payment):
+    order = payment.order
+    return [
+        SMSOutbox(user=order.wholesaler, message_body=f"Payment of {payment.amount} MWK for order {order.order_id} confirmed."),
+        SMSOutbox(
+            user=order.croplisting.farmer,
+            message_body=f"Payment of {payment.amount} MWK for "
+                         f"{order.croplisting.quantity} KG of "
+                         f"{order.croplisting.crop.crop_name} confirmed."
+        ),
+    ]
+
+
+def apply_stk_callback(checkout_id, result_code, result_desc=''):
+    # Returns the new status, or None when the callback is unknown or a re-delivery.
+    payment = Payment.objects.select_related(
+        'order__wholesaler', 'order__croplisting__crop', 'order__croplisting__farmer'
+    ).filter(transaction_ref=checkout_id).first()
+    if not payment:
+        logger.warning(f"Payment with CheckoutRequestID {checkout_id} not found")
+        return None
+    status = callback_status(result_code)
+    with transaction.atomic():
+        # Only the first delivery moves the payment out of 'pending'; repeats update nothing.
+        if not Payment.objects.filter(pk=payment.pk, payment_status='pending').update(payment_status=status):
+            logger.info(f"Ignoring repeated callback for {checkout_id} (payment is {payment.payment_status})")
+            return None
+        if status == 'completed':
+            Order.objects.filter(pk=payment.order_id).update(status='paid', updated_at=timezone.now())
+            SMSOutbox.objects.bulk_create(confirmation_messages(payment))
+        else:
+            logger.warning(f"Payment failed: {result_code} - {result_desc}")
+    return status
+
+
+def apply_results(results, now=None):
+    # results maps CheckoutRequestID -> ResultCode. Call inside a transaction;
+    # payments no longer pending are skipped, so re-applying is harmless.
+    now = now or timezone.now()
+    payments = list(Payment.objects.select_for_update().filter(
+        transaction_ref__in=list(results), payment_status='pending'
+    ).values_list('payment_id', 'transaction_ref'))
+    completed = [pk for pk, ref in payments if callback_status(results[ref]) == 'completed']
+    failed = [pk for pk, ref in payments if callback_status(results[ref]) == 'failed']
+    if completed:
+        confirmed = list(Payment.objects.select_related(
+            'order__wholesaler', 'order__croplisting__crop', 'order__croplisting__farmer'
+        ).filter(pk__in=completed))
+        Payment.objects.filter(pk__in=completed).update(payment_status='completed')
+        Order.objects.filter(pk__in=[payment.order_id for payment in confirmed]).update(status='paid', updated_at=now)
+        SMSOutbox.objects.bulk_create([message for payment in confirmed for message in confirmation_messages(payment)])
+    if failed:
+        Payment.objects.filter(pk__in=failed).update(payment_status='failed')
+    return completed, failed
+
+
+def record_callback(body):
+    return PaymentCallback.objects.create(body=body)
+
+
+def apply_callback_batch(batch_size=500):
+    # Applies the oldest unapplied callbacks with a handful of set-based
+    # statements; the first callback seen for a payment wins, later ones are no-ops.
+    now = timezone.now()
+    with transaction.atomic():
+        entries = list(
+            PaymentCallback.objects.select_for_update(skip_locked=True)
+            .filter(applied_at__isnull=True).order_by('callback_id')[:batch_size]
+        )
+        if not entries:
+            return 0
+        results = {}
+        for entry in entries:
+            checkout_id, result_code, _ = parse_stk_callback(entry.body)
+            if checkout_id:
+                results.setdefault(checkout_id, result_code)
+            else:
+                # Marked applied below with the rest so it cannot wedge the queue.
+                logger.warning(f"Skipping malformed M-Pesa callback {entry.pk}")
+        completed, failed = apply_results(results, now)
+        PaymentCallback.objects.filter(pk__in=[entry.pk for entry in entries]).update(applied_at=now)
+    logger.info(f"Applied {len(entries)} callbacks: {len(completed)} completed, {len(failed)} failed")
+    return len(entries)
+
+
+def replay_callbacks(from_offset):
+    return PaymentCallback.objects.filter(callback_id__gte=from_offset).update(applied_at=None)
+
+
+def stale_pending_payments(older_than, after=0, limit=200):
+    # One keyset chunk of (payment_id, transaction_ref) for payments still waiting on a callback.
+    return list(Payment.objects.filter(
+        payment_status='pending', transaction_ref__isnull=False,
+        created_at__lte=timezone.now() - older_than, payment_id__gt=after
+    ).order_by('payment_id').values_list('payment_id', 'transaction_ref')[:limit])
+
+
+def query_stk_result(client, checkout_id):
+    # Returns the final ResultCode, or None while the payment is still in progress or the query failed.
+    response = client.stk_query(checkout_id)
+    if 'error' in response or 'ResultCode' not in response:
+        return None
+    return response['ResultCode']
+
+
+def reconcile_pending_payments(older_than=timedelta(minutes=10), chunk_size=200, workers=8):
+    client = DarajaClient()
+    checked = completed = failed = 0
+    after = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stk-query') as pool:
+        while True:
+            chunk = stale_pending_payments(older_than, after, chunk_size)
+            if not chunk:
+                break
+            after = chunk[-1][0]
+            refs = [ref for _, ref in chunk]
+            codes = pool.map(lambda ref: query_stk_result(client, ref), refs)
+            results = {ref: code for ref, code in zip(refs, codes) if code is not None}
+            if results:
+                with transaction.atomic():
+                    done, lost = apply_results(results)
+                completed += len(done)
+                failed += len(lost)
+            checked += len(chunk)
+    logger.info(f"Reconciled {checked} stale payments: {completed} completed, {failed} failed")
+    return checked, completed, failed
@@ -0,0 +1,98 @@
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.utils import timezone
+from .caching import bump_version
+from .models import MarketPriceHistory, MarketPriceRollup
+
+
+def period_starts(when):
+    day = timezone.localdate(when)
+    return {'day': day, 'week': day - timedelta(days=day.weekday())}
+
+
+def record_prices(entries, when=None):
+    # entries: iterable of (crop_id, location, price). Appends one history row
+    # each and folds them into the day/week rollups, so rollup reads never
+    # have to scan history.
+    when = when or timezone.now()
+    entries = list(entries)
+    if not entries:
+        return
+    starts = period_starts(when)
+    buckets = {}
+    for crop_id, location, price in entries:
+        for period, start in starts.items():
+            key = (crop_id, location, period, start)
+            low, high, total, samples = buckets.get(key, (price, price, 0, 0))
+            buckets[key] = (min(low, price), max(high, price), total + price, samples + 1)
+    with transaction.atomic():
+        MarketPriceHistory.objects.bulk_create(
+            MarketPriceHistory(crop_id=crop_id, location=location, price_per_unit=price, recorded_at=when)
+            for crop_id, location, price in entries
+        )
+        # Make sure every bucket row exists (empty, samples=0) before locking,
+        # so two first writers to a bucket serialize on the row instead of
+        # the later upsert overwriting the earlier one's totals.
+        MarketPriceRollup.objects.bulk_create(
+            [
+                MarketPriceRollup(
+                    crop_id=crop_id, location=location, period=period, period_start=start,
+                    min_price=low, max_price=high, total_price=0, samples=0,
+                )
+                for (crop_id, location, period, start), (low, high, _, _) in buckets.items()
+            ],
+            ignore_conflicts=True,
+        )
+        rollups = MarketPriceRollup.objects.select_for_update().filter(
+            crop_id__in={key[0] for key in buckets},
+            location__in={key[1] for key in buckets},
+            period_start__in=set(starts.values()),
+        )
+        updated = []
+        for rollup in rollups:
+            key = (rollup.crop_id, rollup.location, rollup.period, rollup.period_start)
+            if key not in buckets or starts[rollup.period] != rollup.period_start:
+                continue
+            low, high, total, samples = buckets[key]
+            if rollup.samples:
+                low, high = min(low, rollup.min_price), max(high, rollup.max_price)
+            rollup.min_price, rollup.max_price = low, high
+            rollup.total_price += total
+            rollup.samples += samples
+            rollup.updated_at = timezone.now()
+            updated.append(rollup)
+        MarketPriceRollup.objects.bulk_update(updated, ['min_price', 'max_price', 'total_price', 'samples', 'updated_at'])
+
+
+def rebuild_rollups(since=None, batch_size=5000):
+    # Recomputes rollups from history, e.g. after a manual backfill. Streams
+    # history in order, so memory grows with the number of buckets, not rows.
+    history = MarketPriceHistory.objects.all()
+    rollups = MarketPriceRollup.objects.all()
+    if since:
+        starts = period_starts(since)
+        since = timezone.make_aware(datetime.combine(starts['week'], time.min))
+        history = history.filter(recorded_at__gte=since)
+        rollups = rollups.filter(period_start__gte=starts['week'])
+    buckets = {}
+    for crop_id, location, price, recorded_at in history.values_list(
+        'crop_id', 'location', 'price_per_unit', 'recorded_at'
+    ).iterator(chunk_size=batch_size):
+        for period, start in period_starts(recorded_at).items():
+            key = (crop_id, location, period, start)
+            low, high, total, samples = buckets.get(key, (price, price, 0, 0))
+            buckets[key] = (min(low, price), max(high, price), total + price, samples + 1)
+    with transaction.atomic():
+        rollups.delete()
+        MarketPriceRollup.objects.bulk_create(
+            (
+                MarketPriceRollup(
+                    crop_id=crop_id, location=location, period=period, period_start=start,
+                    min_price=low, max_price=high, total_price=total, samples=samples,
+                )
+                for (crop_id, location, period, start), (low, high, total, samples) in buckets.items()
+            ),
+            batch_size=batch_size,
+        )
+        transaction.on_commit(lambda: bump_version('marketprice'))
+    return len(buckets)
@@ -0,0 +1,165 @@
+import csv
+import io
+import json
+import re
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from .caching import bump_version, crop_choices
+from .models import MarketPrice, DISTRICT_TO_REGION
+from .price_history import record_prices
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+READ_SIZE = 64 * 1024
+# Largest single JSON object accepted; a bad or unterminated object stops the
+# import here instead of pulling the rest of the file into the buffer.
+MAX_JSON_OBJECT_SIZE = 16 * READ_SIZE
+SEPARATORS = re.compile(r'[\s,\[\]]*')
+REGIONS = frozenset(DISTRICT_TO_REGION.values())
+PRICE_FIELD = MarketPrice._meta.get_field('price_per_unit')
+LOCATION_MAX_LENGTH = MarketPrice._meta.get_field('location').max_length
+
+
+class PriceRowError(ValueError):
+    pass
+
+
+def iter_csv_rows(stream):
+    yield from csv.DictReader(stream)
+
+
+def iter_json_rows(stream):
+    # Streams objects out of a top-level JSON array or JSON Lines without
+    # loading the whole document: raw_decode one object at a time from a
+    # rolling buffer.
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+    while True:
+        pos = SEPARATORS.match(buffer, pos).end()
+        if pos < len(buffer):
+            try:
+                row, pos = decoder.raw_decode(buffer, pos)
+                yield row
+                continue
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                if len(buffer) - pos > MAX_JSON_OBJECT_SIZE:
+                    raise ValueError(f"No complete JSON object within {MAX_JSON_OBJECT_SIZE} characters")
+        elif eof:
+            return
+        chunk = stream.read(READ_SIZE)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk, 0
+
+
+def iter_price_rows(stream, file_format):
+    if file_format == 'csv':
+        return iter_csv_rows(stream)
+    if file_format == 'json':
+        return iter_json_rows(stream)
+    raise ValueError(f"Unsupported price file format: {file_format}")
+
+
+def text_stream(fileobj):
+    if isinstance(fileobj, io.TextIOBase):
+        return fileobj
+    return io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+
+
+def parse_price_row(row, crops_by_name, crop_ids):
+    if not isinstance(row, dict):
+        raise PriceRowError("Row is not an object")
+    crop_id = row.get('crop_id')
+    if crop_id not in (None, ''):
+        try:
+            crop_id = int(crop_id)
+        except (TypeError, ValueError):
+            raise PriceRowError(f"Invalid crop_id {crop_id!r}")
+        if crop_id not in crop_ids:
+            raise PriceRowError(f"Unknown crop_id {crop_id}")
+    else:
+        crop_name = str(row.get('crop') or '').strip()
+        crop_id = crops_by_name.get(crop_name.lower())
+        if crop_id is None:
+            raise PriceRowError(f"Unknown crop {crop_name!r}")
+    location = str(row.get('location') or '').strip()
+    if location not in REGIONS or len(location) > LOCATION_MAX_LENGTH:
+        raise PriceRowError(f"Unknown region {location!r}")
+    try:
+        price = Decimal(str(row.get('price_per_unit')).strip())
+    except (InvalidOperation, ValueError):
+        raise PriceRowError(f"Invalid price {row.get('price_per_unit')!r}")
+    if not price.is_finite() or price <= 0:
+        raise PriceRowError(f"Price must be a positive number, got {price}")
+    price = price.quantize(Decimal(1).scaleb(-PRICE_FIELD.decimal_places))
+    if len(price.as_tuple().digits) > PRICE_FIELD.max_digits:
+        raise PriceRowError(f"Price {price} is too large")
+    return crop_id, location, price
+
+
+def upsert_prices(prices):
+    # prices maps (crop_id, location) -> price; one INSERT ... ON CONFLICT per chunk.
+    with transaction.atomic():
+        current = {
+            (crop_id, location): price
+            for crop_id, location, price in MarketPrice.objects.select_for_update().filter(
+                crop_id__in={crop_id for crop_id, _ in prices}, location__in={location for _, location in prices}
+            ).values_list('crop_id', 'location', 'price_per_unit')
+        }
+        MarketPrice.objects.bulk_create(
+            [MarketPrice(crop_id=crop_id, location=location, price_per_unit=price) for (crop_id, location), price in prices.items()],
+            update_conflicts=True,
+            unique_fields=['crop', 'location'],
+            update_fields=['price_per_unit', 'updated_at'],
+        )
+        # Unchanged prices are re-confirmed (updated_at) but add no history sample.
+        record_prices((crop_id, location, price) for (crop_id, location), price in prices.items() if current.get((crop_id, location)) != price)
+        # bulk_create sends no signals, so price menus and API validators are invalidated here, once per chunk.
+        transaction.on_commit(lambda: bump_version('marketprice'))
+
+
+def import_prices(rows, chunk_size=CHUNK_SIZE, on_error=None):
+    # Validates and upserts row chunks as they stream in; memory is bounded by
+    # chunk_size and MAX_REPORTED_ERRORS, not by the size of the file.
+    crops = crop_choices()
+    crops_by_name = {crop_name.lower(): crop_id for crop_id, crop_name in crops}
+    crop_ids = {crop_id for crop_id, _ in crops}
+    result = {'rows': 0, 'upserted': 0, 'failed': 0, 'errors': []}
+    pending = {}
+
+    def flush():
+        if pending:
+            upsert_prices(pending)
+            result['upserted'] += len(pending)
+            pending.clear()
+
+    def reject(number, message):
+        result['failed'] += 1
+        if len(result['errors']) < MAX_REPORTED_ERRORS:
+            result['errors'].append({'row': number, 'error': message})
+        if on_error:
+            on_error(number, message)
+
+    number = 0
+    try:
+        for number, row in enumerate(rows, 1):
+            result['rows'] += 1
+            try:
+                crop_id, location, price = parse_price_row(row, crops_by_name, crop_ids)
+            except PriceRowError as e:
+                reject(number, str(e))
+                continue
+            # A later row for the same (crop, location) in the chunk wins.
+            pending[crop_id, location] = price
+            if len(pending) >= chunk_size:
+                flush()
+    except (ValueError, csv.Error) as e:
+        # A malformed file stops the import; chunks before this point stay applied.
+        reject(number + 1, f"Unreadable input, import stopped: {e}")
+    flush()
+    logger.info(f"Price import: {result['rows']} rows, {result['upserted']} upserted, {result['failed']} rejected")
+    return result
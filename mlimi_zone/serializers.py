@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import ProduceListing, Cart, Order, Payment, MarketPrice, Crop, User
+from .models import ProduceListing, Cart, Order, Payment, MarketPrice, MarketPriceRollup, Crop, User
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -17,13 +17,27 @@ class MarketPriceSerializer(serializers.ModelSerializer):
         model = MarketPrice
         fields = ('market_price_id', 'crop', 'crop_id', 'location', 'price_per_unit', 'created_at', 'updated_at')
 
+class PriceRollupSerializer(serializers.ModelSerializer):
+    crop = CropSerializer(read_only=True)
+    avg_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    class Meta:
+        model = MarketPriceRollup
+        fields = ('rollup_id', 'crop', 'location', 'period', 'period_start', 'min_price', 'avg_price', 'max_price', 'samples')
+
 class ProduceListingSerializer(serializers.ModelSerializer):
     farmer = UserSerializer(read_only=True)
     farmer_id = serializers.PrimaryKeyRelatedField(write_only=True, queryset=User.objects.filter(role='farmer'), source='farmer')
     class Meta:
         model = ProduceListing
-        fields = ('croplisting_id', 'farmer', 'farmer_id', 'crop', 'quantity', 'created_at')
-        read_only_fields = ('croplisting_id', 'created_at')
+        fields = ('croplisting_id', 'farmer', 'farmer_id', 'crop', 'quantity', 'is_available', 'created_at')
+        read_only_fields = ('croplisting_id', 'is_available', 'created_at')
+
+class ProduceListingBulkItemSerializer(serializers.Serializer):
+    # Shape only: farmer and crop ids are checked for the whole batch at once
+    # by ProduceListingViewSet.bulk_create instead of one query per item.
+    farmer_id = serializers.IntegerField()
+    crop = serializers.IntegerField()
+    quantity = serializers.DecimalField(max_digits=10, decimal_places=2)
 
 class OrderSerializer(serializers.ModelSerializer):
     croplisting = ProduceListingSerializer(read_only = True)
@@ -35,7 +49,7 @@ class CartSerializer(serializers.ModelSerializer):
     orders = OrderSerializer(many = True, read_only = True)
     class Meta:
         model = Cart
-        fields = ('cart_id', 'wholesaler', 'created_at', 'updated_at')
+        fields = ('cart_id', 'wholesaler', 'orders', 'created_at', 'updated_at')
         
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
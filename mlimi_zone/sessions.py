@@ -0,0 +1,160 @@
+from collections import OrderedDict
+from functools import lru_cache
+from datetime import timedelta
+from threading import Lock, Thread
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import USSDSession
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_TTL = 180
+
+
+class BaseSessionStore:
+    def __init__(self, ttl=DEFAULT_SESSION_TTL, **options):
+        self.ttl = ttl
+
+    def load(self, session_id):
+        raise NotImplementedError
+
+    def save(self, session_id, phone_number, data, created=False):
+        raise NotImplementedError
+
+    def touch(self, session_id):
+        # Extends the TTL of a live session whose data did not change this step.
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+
+class DatabaseSessionStore(BaseSessionStore):
+    def __init__(self, ttl=DEFAULT_SESSION_TTL, sweep_interval=0, purge_batch_size=1000, **options):
+        super().__init__(ttl=ttl)
+        self.sweeper = None
+        if sweep_interval:
+            self.sweeper = SessionSweeper(sweep_interval, purge_batch_size)
+            self.sweeper.start()
+
+    def expiry(self):
+        return timezone.now() + timedelta(seconds=self.ttl)
+
+    def load(self, session_id):
+        return USSDSession.objects.live().filter(session_id=session_id).values_list('data', flat=True).first()
+
+    def save(self, session_id, phone_number, data, created=False):
+        if created:
+            # A row left behind by an abandoned dial may still hold the unique session_id.
+            USSDSession.objects.update_or_create(
+                session_id=session_id,
+                defaults={'phone_number': phone_number, 'data': data, 'expires_at': self.expiry()},
+            )
+        else:
+            USSDSession.objects.filter(session_id=session_id).update(data=data, expires_at=self.expiry())
+
+    def touch(self, session_id):
+        USSDSession.objects.filter(session_id=session_id).update(expires_at=self.expiry())
+
+    def delete(self, session_id):
+        USSDSession.objects.filter(session_id=session_id).delete()
+
+
+class SessionSweeper(Thread):
+    def __init__(self, interval, batch_size=1000):
+        super().__init__(name='ussd-session-sweeper', daemon=True)
+        self.interval = interval
+        self.batch_size = batch_size
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                deleted = USSDSession.objects.purge_expired(batch_size=self.batch_size)
+                if deleted:
+                    logger.info(f"Purged {deleted} expired USSD sessions")
+            except Exception as e:
+                logger.error(f"USSD session sweep failed: {e}")
+            finally:
+                close_old_connections()
+
+
+# Only safe when every hop of a session reaches the same process (single worker
+# or sticky routing); use CacheSessionStore with a shared cache otherwise.
+class MemorySessionStore(BaseSessionStore):
+    def __init__(self, ttl=DEFAULT_SESSION_TTL, max_entries=10000, **options):
+        super().__init__(ttl=ttl)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at <= time.monotonic():
+                del self._entries[session_id]
+                return None
+            self._entries.move_to_end(session_id)
+            return data
+
+    def save(self, session_id, phone_number, data, created=False):
+        with self._lock:
+            self._entries[session_id] = (time.monotonic() + self.ttl, data)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def touch(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                self._entries[session_id] = (time.monotonic() + self.ttl, entry[1])
+
+    def delete(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+
+class CacheSessionStore(BaseSessionStore):
+    key_prefix = 'ussd:session:'
+
+    def __init__(self, ttl=DEFAULT_SESSION_TTL, cache_alias='default', **options):
+        super().__init__(ttl=ttl)
+        self.cache = caches[cache_alias]
+
+    def load(self, session_id):
+        return self.cache.get(self.key_prefix + session_id)
+
+    def save(self, session_id, phone_number, data, created=False):
+        self.cache.set(self.key_prefix + session_id, data, self.ttl)
+
+    def touch(self, session_id):
+        self.cache.touch(self.key_prefix + session_id, self.ttl)
+
+    def delete(self, session_id):
+        self.cache.delete(self.key_prefix + session_id)
+
+
+@lru_cache(maxsize=None)
+def get_session_store():
+    config = dict(getattr(settings, 'USSD_SESSION_STORE', {}))
+    backend = import_string(config.pop('BACKEND', 'mlimi_zone.sessions.DatabaseSessionStore'))
+    options = {key.lower(): value for key, value in config.get('OPTIONS', {}).items()}
+    logger.info(f"Using USSD session store {backend.__name__}")
+    return backend(ttl=config.get('TTL', DEFAULT_SESSION_TTL), **options)
+
+
+@receiver(setting_changed)
+def reset_session_store(setting, **kwargs):
+    if setting == 'USSD_SESSION_STORE':
+        get_session_store.cache_clear()
@@ -0,0 +1,60 @@
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .caching import bump_version, crop_catalog
+from .models import MarketPrice, Crop, Order, ProduceListing
+from .price_history import record_prices
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@receiver([post_save, post_delete], sender=MarketPrice)
+@receiver([post_save, post_delete], sender=Crop)
+def invalidate_price_menus(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version('marketprice'))
+
+
+@receiver(pre_save, sender=MarketPrice)
+def remember_previous_price(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk is not None:
+        instance._previous_price = MarketPrice.objects.filter(pk=instance.pk).values_list('price_per_unit', flat=True).first()
+
+
+# Only real changes become history samples; re-saving the same price is not a new observation.
+@receiver(post_save, sender=MarketPrice)
+def record_price_history(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else getattr(instance, '_previous_price', None)
+    if previous is None or previous != instance.price_per_unit:
+        record_prices([(instance.crop_id, instance.location, instance.price_per_unit)], instance.updated_at)
+
+
+@receiver([post_save, post_delete], sender=Crop)
+def invalidate_crop_catalog(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version('crop'))
+
+
+# AppConfig.ready() must not query, so each worker loads the crop catalog as
+# it starts serving instead of on a caller's first crop menu.
+@receiver(request_started, dispatch_uid='warm_crop_catalog')
+def warm_crop_catalog(sender, **kwargs):
+    request_started.disconnect(dispatch_uid='warm_crop_catalog')
+    try:
+        crop_catalog()
+    except Exception:
+        logger.exception("Could not warm the crop catalog")
+
+
+# Run inside the transaction that creates or deletes the order.
+@receiver(post_save, sender=Order)
+def mark_listing_booked(sender, instance, created, **kwargs):
+    if created:
+        ProduceListing.objects.filter(pk=instance.croplisting_id, is_available=True).update(is_available=False)
+
+
+@receiver(post_delete, sender=Order)
+def mark_listing_available(sender, instance, **kwargs):
+    ProduceListing.objects.filter(pk=instance.croplisting_id).update(is_available=True)
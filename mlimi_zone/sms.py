@@ -1,20 +1,26 @@
 import json
-import requests
 import os, sys
 from dotenv import load_dotenv
 import base64
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mlimizone.settings')
+from mlimi_zone import httpclient
 
 load_dotenv()
 USERNAME_SMS =os.getenv("USERNAME_SMS")
 PASSWORD= os.getenv("PASSWORD")
 SOURCE = os.getenv("SOURCE")
+SMS_API_URL = os.getenv("SMS_API_URL", "https://api.smsleopard.com/v1/sms/send")
+# Destinations per request when one body goes to many recipients.
+MAX_DESTINATIONS = 100
 
 
 def send_sms(destination, message):
-    url = "https://api.smsleopard.com/v1/sms/send"
+    return send_bulk_sms([destination], message)
+
+
+def send_bulk_sms(destinations, message):
     credentials = f"{USERNAME_SMS}:{PASSWORD}"
     base64_credentials = base64.b64encode(credentials.encode()).decode()
     headers = {
@@ -25,14 +31,10 @@ def send_sms(destination, message):
         "source": SOURCE,
         "multi": False,
         "message": message,
-        "destination": [
-            {
-                "number": destination
-            }
-        ]
+        "destination": [{"number": destination} for destination in destinations]
     }
 
-    response = requests.post(url, data=json.dumps(payload), headers=headers)
+    response = httpclient.post(SMS_API_URL, 'smsleopard.send', data=json.dumps(payload), headers=headers)
     if response.status_code == 200:
         print(response.text)
         print("SMS sent successfully")
@@ -0,0 +1,134 @@
+from decimal import Decimal
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from mlimi_zone.exports import export_queryset
+from mlimi_zone.models import User, Crop, MarketPrice, ProduceListing, Cart, Order, Payment, SMSLogs
+from mlimi_zone.views import (
+    ProduceListingViewSet, CartViewSet, OrderViewSet, PaymentViewSet, MarketPriceViewSet, CropViewSet,
+    PriceRollupViewSet
+)
+
+# (viewset, role making the request, model whose first row is retrieved, queries for list, queries for retrieve)
+ENDPOINTS = [
+    (ProduceListingViewSet, 'farmer', ProduceListing, 1, 1),
+    (CartViewSet, 'wholesaler', Cart, 2, 2),
+    (OrderViewSet, 'wholesaler', Order, 1, 1),
+    (OrderViewSet, 'farmer', Order, 1, 1),
+    (PaymentViewSet, 'wholesaler', Payment, 1, 1),
+    (PaymentViewSet, 'farmer', Payment, 1, 1),
+    (MarketPriceViewSet, None, MarketPrice, 1, 1),
+    (CropViewSet, None, Crop, 1, 1),
+]
+
+
+class ApiQueryCountMixin:
+    # Every list and retrieve must cost the same number of queries however
+    # many rows exist; the counts are pinned at two dataset sizes.
+    size = None
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = {
+            'farmer': User.objects.create(name='Test Farmer', role='farmer', location='Blantyre', phone_number='254700000011'),
+            'wholesaler': User.objects.create(name='Test Wholesaler', role='wholesaler', location='Lilongwe', phone_number='254700000012'),
+        }
+        cart = Cart.objects.get(wholesaler=cls.users['wholesaler'])
+        crops = Crop.objects.bulk_create(Crop(crop_name=f'Test crop {i}') for i in range(cls.size))
+        MarketPrice.objects.bulk_create(
+            MarketPrice(crop=crop, location='Southern Region', price_per_unit=Decimal('500')) for crop in crops
+        )
+        listings = ProduceListing.objects.bulk_create(
+            ProduceListing(farmer=cls.users['farmer'], crop=crop, quantity=Decimal('100')) for crop in crops
+        )
+        orders = Order.objects.bulk_create(
+            Order(cart=cart, wholesaler=cls.users['wholesaler'], croplisting=listing, price=Decimal('50000')) for listing in listings
+        )
+        Payment.objects.bulk_create(
+            Payment(order=order, amount=order.price, payment_status='pending') for order in orders
+        )
+
+    def request(self, viewset, action, role, **kwargs):
+        request = APIRequestFactory().get('/', HTTP_HOST='localhost')
+        if role:
+            force_authenticate(request, user=self.users[role])
+        response = viewset.as_view({'get': action})(request, **kwargs)
+        response.render()
+        return response
+
+    def test_list_query_count(self):
+        for viewset, role, model, list_queries, _ in ENDPOINTS:
+            with self.subTest(viewset=viewset.__name__, role=role):
+                with self.assertNumQueries(list_queries):
+                    response = self.request(viewset, 'list', role)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.data['results'])
+
+    def test_retrieve_query_count(self):
+        for viewset, role, model, _, retrieve_queries in ENDPOINTS:
+            with self.subTest(viewset=viewset.__name__, role=role):
+                pk = model.objects.order_by('pk').values_list('pk', flat=True).first()
+                with self.assertNumQueries(retrieve_queries):
+                    response = self.request(viewset, 'retrieve', role, pk=pk)
+                self.assertEqual(response.status_code, 200)
+
+
+class ApiQueryCountSmallTests(ApiQueryCountMixin, TestCase):
+    size = 10
+
+
+class ApiQueryCountLargeTests(ApiQueryCountMixin, TestCase):
+    size = 1000
+
+
+class PriceTrendFilterTests(TestCase):
+    def get(self, query):
+        request = APIRequestFactory().get(f'/?{query}', HTTP_HOST='localhost')
+        response = PriceRollupViewSet.as_view({'get': 'list'})(request)
+        response.render()
+        return response
+
+    def test_bad_filters_are_rejected(self):
+        for query in ('crop_id=abc', 'period=month', 'since=nope'):
+            with self.subTest(query=query):
+                self.assertEqual(self.get(query).status_code, 400)
+
+    def test_valid_filters(self):
+        self.assertEqual(self.get('crop_id=1&period=day').status_code, 200)
+
+
+class ExportDateRangeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(name='Test Farmer', role='farmer', location='Blantyre', phone_number='254700000021')
+        cls.log = SMSLogs.objects.create(user=user, message_body='hello', status='delivered')
+        cls.today = timezone.localdate(cls.log.sent_at).isoformat()
+
+    def test_single_day_covers_the_whole_day(self):
+        rows = export_queryset('smslogs', since=self.today, until=self.today)
+        self.assertEqual([row[0] for row in rows], [self.log.pk])
+
+    def test_datetime_until_is_exclusive(self):
+        rows = export_queryset('smslogs', until=self.log.sent_at.isoformat())
+        self.assertFalse(rows.exists())
+
+
+class BulkListingStatusTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.farmer = User.objects.create(name='Test Farmer', role='farmer', location='Blantyre', phone_number='254700000031')
+        cls.crop = Crop.objects.create(crop_name='Test crop')
+
+    def post(self, items):
+        request = APIRequestFactory().post('/', items, format='json', HTTP_HOST='localhost')
+        force_authenticate(request, user=self.farmer)
+        return ProduceListingViewSet.as_view({'post': 'bulk_create'})(request)
+
+    def test_status_reflects_how_many_items_were_created(self):
+        valid = {'farmer_id': self.farmer.pk, 'crop': self.crop.pk, 'quantity': '10'}
+        invalid = {'farmer_id': self.farmer.pk, 'crop': 0, 'quantity': '10'}
+        self.assertEqual(self.post([valid, valid]).status_code, 201)
+        self.assertEqual(self.post([valid, invalid]).status_code, 207)
+        response = self.post([invalid, invalid])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], 0)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import (  ProduceListingViewSet,  CartViewSet,  OrderViewSet,  PaymentViewSet,  MarketPriceViewSet,  CropViewSet,  PaymentCallbackView )
+from .views import (  ProduceListingViewSet,  CartViewSet,  OrderViewSet,  PaymentViewSet,  MarketPriceViewSet,  CropViewSet,  PriceRollupViewSet,  ExportView,  PaymentCallbackView )
 from .ussd import USSDView
 
 app_name = 'mlimi_zone'
@@ -12,8 +12,10 @@ router.register(r'orders', OrderViewSet)
 router.register(r'payments', PaymentViewSet)
 router.register(r'marketprices', MarketPriceViewSet)
 router.register(r'crops', CropViewSet)
+router.register(r'pricetrends', PriceRollupViewSet)
 
 urlpatterns = [
+    path('api/exports/<str:name>/', ExportView.as_view(), name='export'),
     path('api/', include(router.urls)),
     path('payment/callback/', PaymentCallbackView.as_view(), name='payment_callback'),
     path('ussd/', USSDView.as_view(), name='ussd'),
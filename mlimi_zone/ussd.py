@@ -1,27 +1,21 @@
 from rest_framework.views import APIView
-from rest_framework.response import Response
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from .models import ProduceListing, Cart, Order, Payment, MarketPrice, Crop, User, USSDSession, SMSLogs
-from .sms import send_sms
-from .daraja import DarajaClient
-from decimal import Decimal
+from django.db import IntegrityError, transaction
+from .models import ProduceListing, Cart, Order, MarketPrice, User, DISTRICT_TO_REGION
+from .caching import price_menu_lines, price_trend_lines, crop_menu_lines, crop_for_choice
+from .menus import Menu, MenuContext, State, NAV_FOOTER, max_response_chars
+from .sessions import get_session_store
+from .outbox import queue_sms
+from .payments import queue_payment
+from decimal import Decimal, InvalidOperation
+import copy
 import logging
 
 logger = logging.getLogger(__name__)
 
-DISTRICT_TO_REGION = {
-   'Blantyre': 'Southern Region', 'Zomba': 'Southern Region', 'Mulanje': 'Southern Region',
-   'Thyolo': 'Southern Region', 'Chiradzulu': 'Southern Region', 'Nsanje': 'Southern Region',
-   'Chikwawa': 'Southern Region', 'Phalombe': 'Southern Region', 'Mwanza': 'Southern Region',
-   'Balaka': 'Southern Region', 'Mangochi': 'Southern Region', 'Machinga': 'Southern Region',
-   'Neno': 'Southern Region',
-   'Lilongwe': 'Central Region', 'Salima': 'Central Region', 'Dowa': 'Central Region',
-   'Ntchisi': 'Central Region', 'Nkhotakota': 'Central Region', 'Kasungu': 'Central Region',
-   'Mchinji': 'Central Region', 'Dedza': 'Central Region', 'Ntcheu': 'Central Region',
-   'Mzimba': 'Northern Region', 'Karonga': 'Northern Region', 'Chitipa': 'Northern Region',
-   'Rumphi': 'Northern Region', 'Nkhata Bay': 'Northern Region', 'Likoma': 'Northern Region'
-}
+QUANTITY_FIELD = ProduceListing._meta.get_field('quantity')
+QUANTITY_MAX = Decimal(10) ** (QUANTITY_FIELD.max_digits - QUANTITY_FIELD.decimal_places) - Decimal(1).scaleb(-QUANTITY_FIELD.decimal_places)
 
 def normalize_phone(phone):
    if not phone or not isinstance(phone, str):
@@ -39,293 +33,308 @@ def normalize_phone(phone):
        return ""
    return phone
 
-class USSDView(APIView):
-   permission_classes = []
+def region_for(location):
+   return DISTRICT_TO_REGION.get(location, 'Southern Region')
 
-   def post(self, request, *args, **kwargs):
-       logger.info(f"Received request: {request.data or request.POST}")
-       session_id = request.data.get('sessionId') or request.POST.get('sessionId')
-       service_code = request.data.get('serviceCode') or request.POST.get('serviceCode')
-       phone = normalize_phone(request.data.get('phoneNumber') or request.POST.get('phoneNumber'))
-       if not phone.startswith('254') or len(phone) != 12:
-           logger.error(f"Invalid phone number format: {phone}")
-           return HttpResponse("END Invalid phone number format. Use 254XXXXXXXXX.", content_type='text/plain')
-       text = (request.data.get('text') or request.POST.get('text') or '').strip()
-       logger.info(f"Parsed: sessionId={session_id}, serviceCode={service_code}, phoneNumber={phone}, text={text}")
-       parts = text.split('*') if text else []
+def crop_state(name, prompt, target, invalid="Invalid crop selection"):
+   # Options come from the Crop table via the in-process catalog in caching.py;
+   # the selection is kept as crop_id so later hops need no lookup by name.
+   def render(ctx):
+       return ctx.con(f"{prompt}\n{crop_menu_lines()}\n{NAV_FOOTER}")
+   def select(ctx, choice):
+       crop = crop_for_choice(choice)
+       if crop is None:
+           return ctx.end(invalid)
+       ctx.data['crop_id'], ctx.data['crop'] = crop
+       return ctx.goto(target)
+   return State(name, render=render, handle=select)
 
-       if parts and parts[-1] == '0':
-           parts = parts[:-1]
+def render_price_list(ctx):
+   crop_name = ctx.data['crop']
+   price_list = price_menu_lines(ctx.data['crop_id'], crop_name)
+   if not price_list:
+       return ctx.con(f"No prices available for {crop_name}.\n{NAV_FOOTER}")
+   return ctx.con(f"Prices for {crop_name}:\n{price_list}\n1. Price trend\n{NAV_FOOTER}")
 
-       user = User.objects.filter(phone_number=phone).first()
+def render_price_trend(ctx):
+   crop_name = ctx.data['crop']
+   region = region_for(ctx.user.location)
+   weeks = price_trend_lines(ctx.data['crop_id'], region).split("\n")
+   if not weeks[0]:
+       return ctx.con(f"No price history for {crop_name} in {region}.\n{NAV_FOOTER}")
+   header = f"{crop_name} weekly prices, {region}:"
+   # Drop the oldest weeks until the screen fits the aggregator's limit.
+   while len(weeks) > 1 and len(ctx.con("\n".join([header, *weeks, NAV_FOOTER]))) > max_response_chars():
+       weeks.pop()
+   return ctx.con("\n".join([header, *weeks, NAV_FOOTER]))
 
-       if not user:
-           return self.handle_registration(parts, phone, session_id)
+PRICE_STATES = [
+   crop_state('prices', "Select crop for market prices:", 'price_list'),
+   State('price_list', options=[('1', 'Price trend', 'price_trend')], render=render_price_list, invalid="Invalid option"),
+   State('price_trend', render=render_price_trend, invalid="Invalid option"),
+]
 
-       if user.role == 'farmer':
-           return farmer_ussd_callback(request)
-       elif user.role == 'wholesaler':
-           return wholesaler_ussd_callback(request)
-       else:
-           return HttpResponse('END Role not supported.', content_type='text/plain')
+# Farmer menu
 
-   def handle_registration(self, parts, phone, session_id):
-       try:
-           session = USSDSession.objects.get(session_id=session_id)
-           session_data = session.data or {'level': 'reg_1'}
-       except USSDSession.DoesNotExist:
-           session_data = {'level': 'reg_1'}
-           session = USSDSession.objects.create(session_id=session_id, phone_number=phone, data=session_data)
-
-       response = "END Invalid session state. Please start over." 
-
-       if session_data['level'] == 'reg_1':
-           if len(parts) == 0:
-               response = "CON Welcome to MlimiZone. Register as:\n1. Farmer\n2. Wholesaler"
-           else:
-               role_choice = parts[0]
-               if role_choice not in ['1', '2']:
-                   response = "CON Invalid choice.\n1. Farmer\n2. Wholesaler"
-               else:
-                   session_data['level'] = 'reg_2'
-                   session_data['role_choice'] = role_choice
-                   response = "CON Enter your full name:"
-                   session.data = session_data
-                   session.save()
-       elif session_data['level'] == 'reg_2':
-           if len(parts) < 2:
-               response = "CON Enter your full name:"
-           else:
-               name = parts[1].strip()
-               if not name:
-                   response = "CON Invalid name. Enter your full name:"
-               else:
-                   session_data['name'] = name
-                   session_data['level'] = 'reg_3'
-                   response = "CON Enter your district (e.g., Blantyre, Lilongwe, Mzimba):"
-                   session.data = session_data
-                   session.save()
-       elif session_data['level'] == 'reg_3':
-           if len(parts) < 3:
-               response = "CON Enter your district (e.g., Blantyre, Lilongwe, Mzimba):"
-           else:
-               district = parts[2].strip().title()
-               if district not in DISTRICT_TO_REGION:
-                   response = "CON Invalid district. Enter your district (e.g., Blantyre, Lilongwe, Mzimba):"
-               else:
-                   role_choice = session_data.get('role_choice')
-                   name = session_data.get('name')
-                   if not role_choice or not name:
-                       logger.error(f"Missing role_choice or name in session_data: {session_data}")
-                       response = "END Session error. Please start over."
-                       USSDSession.objects.filter(session_id=session_id).delete()
-                   else:
-                       role = 'farmer' if role_choice == '1' else 'wholesaler'
-                       user = User.objects.create(name=name, role=role, location=district, phone_number=phone)
-                       message_body = f"Welcome to MlimiZone, {name}! You are registered as a {role}."
-                       sms_response = send_sms(phone, message_body)
-                       SMSLogs.objects.create(
-                           user=user,
-                           message_body=message_body,
-                           status='delivered' if sms_response.get('status_code') == 200 else 'failed'
-                       )
-                       USSDSession.objects.filter(session_id=session_id).delete()
-                       self.request.POST._mutable = True
-                       self.request.POST['text'] = ''
-                       if role == 'farmer':
-                           return farmer_ussd_callback(self.request)
-                       else:
-                           return wholesaler_ussd_callback(self.request)
-       else:
-           logger.error(f"Invalid session level: {session_data['level']} for session {session_id}")
-           USSDSession.objects.filter(session_id=session_id).delete()
-           response = "END Invalid session state. Please start over."
+def render_quantity(ctx):
+   return ctx.con(f"Enter quantity in KG for {ctx.data.get('crop')}:\n{NAV_FOOTER}")
 
-       if 'END' not in response:
-           session.data = session_data
-           session.save()
-       logger.info(f"Sending response: {response}")
-       return HttpResponse(response, content_type='text/plain')
+def handle_quantity(ctx, choice):
+   user = ctx.user
+   crop_id, crop_name = ctx.data.get('crop_id'), ctx.data.get('crop')
+   try:
+       quantity = Decimal(choice)
+       if not quantity.is_finite() or quantity <= 0:
+           return ctx.con(f"Invalid quantity. Enter a number above 0 for {crop_name}:\n{NAV_FOOTER}")
+       # Keep within ProduceListing.quantity so the insert cannot overflow the column.
+       quantity = quantity.quantize(Decimal(1).scaleb(-QUANTITY_FIELD.decimal_places))
+       if quantity <= 0 or len(quantity.as_tuple().digits) > QUANTITY_FIELD.max_digits:
+           return ctx.con(f"Invalid quantity. Enter a number between 0.01 and {QUANTITY_MAX} for {crop_name}:\n{NAV_FOOTER}")
+   except (ValueError, InvalidOperation):
+       return ctx.con(f"Invalid quantity or crop. Enter quantity in KG for {crop_name}:\n{NAV_FOOTER}")
+   user_region = region_for(user.location)
+   price_obj = MarketPrice.objects.filter(crop_id=crop_id, location=user_region).first()
+   if not price_obj:
+       return ctx.con(f"No market price for {crop_name} in {user_region}. Try another crop or contact support.\n{NAV_FOOTER}")
+   price_per_kg = price_obj.price_per_unit
+   total_price = quantity * price_per_kg
+   with transaction.atomic():
+       ProduceListing.objects.create(farmer=user, crop_id=crop_id, quantity=quantity)
+       queue_sms(user, f"Listed {quantity} KG of {crop_name} at {price_per_kg} MWK/kg. Total: {total_price} MWK")
+   ctx.reset('list_crop', ['main'])
+   return ctx.con(f"You have listed {quantity} KG of {crop_name} at {price_per_kg} MWK/kg. Total: {total_price} MWK.\n{NAV_FOOTER}")
 
-@csrf_exempt
-def farmer_ussd_callback(request):
+FARMER_MENU = Menu('farmer', 'main', [
+   State('main', "Welcome to MlimiZone Farmers", [
+       ('1', 'See market prices', 'prices'),
+       ('2', 'List your produce', 'list_crop'),
+   ], footer=False),
+   *PRICE_STATES,
+   crop_state('list_crop', "Select crop to list:", 'list_quantity', invalid="Invalid crop option."),
+   State('list_quantity', render=render_quantity, handle=handle_quantity),
+])
+
+# Wholesaler menu
+
+def listing_price(crop, farmer):
+   return MarketPrice.objects.filter(crop=crop, location=region_for(farmer.location)).first()
+
+def region_prices(crop_id):
+   return dict(MarketPrice.objects.filter(crop_id=crop_id).values_list('location', 'price_per_unit'))
+
+def render_listings(ctx):
+   crop_id, crop_name = ctx.data.get('crop_id'), ctx.data.get('crop')
+   listings = ProduceListing.objects.available().filter(crop_id=crop_id).select_related('farmer')
+   prices = region_prices(crop_id)
+   def format_listing(listing):
+       price = prices.get(region_for(listing.farmer.location))
+       price_str = f"at {price} MWK" if price is not None else "(no price)"
+       return f"{listing.farmer.phone_number} - {listing.quantity} KG {price_str}"
+   shown, response = ctx.paginate(listings, 'croplisting_id', f"Available {crop_name} for sale:", format_listing)
+   if not shown:
+       return ctx.end(f"No available {crop_name} listings.")
+   ctx.data['listings'] = [listing.croplisting_id for listing in shown]
+   return response
+
+def handle_listing_choice(ctx, choice):
    try:
-       if request.method != 'POST':
-           return HttpResponse("Method Not Allowed", status=405)
+       selection = int(choice) - 1
+   except ValueError:
+       return ctx.end("Invalid input")
+   if not 0 <= selection < len(ctx.data.get('listings', [])):
+       return ctx.end("Invalid selection")
+   ctx.data['selected_listing'] = ctx.data['listings'][selection]
+   return ctx.goto('book_confirm')
 
-       session_id = request.POST.get('sessionId', '')
-       phone_number = normalize_phone(request.POST.get('phoneNumber', '').strip())
-       text = request.POST.get('text', '').strip()
-       inputs = text.split('*') if text else ['']
+def render_book_confirm(ctx):
+   listing = ProduceListing.objects.select_related('crop', 'farmer').filter(croplisting_id=ctx.data['selected_listing']).first()
+   if not listing:
+       return ctx.end("Invalid input")
+   price = listing_price(listing.crop, listing.farmer)
+   if not price:
+       logger.error(f"No price found for crop {listing.crop.crop_name} in {region_for(listing.farmer.location)}")
+       return ctx.con(f"No market price available. Contact support.\n{NAV_FOOTER}")
+   return ctx.con(f"Confirm booking for {listing.crop.crop_name} from {listing.farmer.phone_number} - {listing.quantity} KG at {price.price_per_unit} MWK?\n1. Yes\n2. No\n{NAV_FOOTER}")
 
-       logger.info(f"farmer_ussd_callback: session_id={session_id}, phone={phone_number}, text={text}, inputs={inputs}")
+class ListingTaken(Exception):
+   pass
 
-       try:
-           user = User.objects.get(phone_number=phone_number)
-       except User.DoesNotExist:
-           return HttpResponse("END Please register first.", content_type='text/plain')
+class ListingUnpriced(Exception):
+   pass
 
-       user_region = DISTRICT_TO_REGION.get(user.location, 'Southern Region')
+def book_listing(user, listing_id):
+   # The conditional UPDATE is the claim: exactly one wholesaler flips
+   # is_available, everyone else fails before doing any other work.
+   with transaction.atomic():
+       if not ProduceListing.objects.filter(croplisting_id=listing_id, is_available=True).update(is_available=False):
+           raise ListingTaken(listing_id)
+       listing = ProduceListing.objects.select_related('crop', 'farmer').get(croplisting_id=listing_id)
+       price = listing_price(listing.crop, listing.farmer)
+       if not price:
+           # Raising rolls the claim back so the listing stays bookable.
+           raise ListingUnpriced(f"No price found for crop {listing.crop.crop_name} in {region_for(listing.farmer.location)}")
+       cart, created = Cart.objects.get_or_create(wholesaler=user)
+       order = Order.objects.create(
+           cart=cart,
+           wholesaler=user,
+           croplisting=listing,
+           price=listing.quantity * price.price_per_unit,
+           status='unpaid'
+       )
+       queue_sms(user, f"Booked {listing.quantity} KG of {listing.crop.crop_name} from {listing.farmer.phone_number} for {order.price} MWK")
+       queue_sms(listing.farmer, f"Hello, your {listing.quantity} KG of {listing.crop.crop_name} has been booked by {user.name}. Expect payment of {order.price} MWK soon.")
+   return order
 
-       try:
-           session = USSDSession.objects.get(session_id=session_id)
-           session_data = session.data or {'level': 1, 'previous_levels': []}
-       except USSDSession.DoesNotExist:
-           session_data = {'level': 1, 'previous_levels': []}
-           session = USSDSession.objects.create(session_id=session_id, phone_number=phone_number, data=session_data)
-
-       level = session_data.get('level', 1)
-       response = "END Invalid session state."
-
-       if level == 1:
-           if not text:
-               response = "CON Welcome to MlimiZone Farmers\n1. See market prices\n2. List your produce"
-           else:
-               current_input = inputs[-1] 
-               if current_input == '1':
-                   session_data['previous_levels'].append(1)
-                   session_data['level'] = 1.1
-                   response = "CON Select crop for market prices:\n1. Maize\n2. Peas\n3. Rice\n4. Ground nuts\n0. Back\n00. Main menu"
-               elif current_input == '2':
-                   session_data['previous_levels'].append(1)
-                   session_data['level'] = 2.1
-                   response = "CON Select crop to list:\n1. Maize\n2. Peas\n3. Rice\n4. Ground nuts\n0. Back\n00. Main menu"
-               elif current_input == '00':
-                   session_data['level'] = 1
-                   session_data['previous_levels'] = []
-                   request.POST._mutable = True
-                   request.POST['text'] = '' 
-                   response = "CON Welcome to MlimiZone Farmers\n1. See market prices\n2. List your produce\n00. Main menu"
-               else:
-                   response = "END Invalid option."
-                   USSDSession.objects.filter(session_id=session_id).delete()
-       elif level == 1.1:
-           if inputs[-1] == '0':
-               session_data['level'] = session_data['previous_levels'].pop() if session_data['previous_levels'] else 1
-               response = "CON Welcome to MlimiZone Farmers\n1. See market prices\n2. List your produce\n00. Main menu"
-           elif inputs[-1] == '00':
-               session_data['level'] = 1
-               session_data['previous_levels'] = []
-               request.POST._mutable = True
-               request.POST['text'] = ''
-               response = "CON Welcome to MlimiZone Farmers\n1. See market prices\n2. List your produce\n00. Main menu"
-           else:
-               crop_map = {'1': 'Maize', '2': 'Peas', '3': 'Rice', '4': 'Ground nuts'}
-               if inputs[-1] in crop_map:
-                   session_data['crop'] = crop_map[inputs[-1]]
-                   session_data['previous_levels'].append(1.1)
-                   session_data['level'] = 1.2
-                   prices = MarketPrice.objects.filter(crop__crop_name=session_data['crop']).order_by('location')
-                   if not prices:
-                       response = f"CON No prices available for {session_data['crop']}.\n0. Back\n00. Main menu"
-                   else:
-                       price_list = "\n".join([f"{price.crop.crop_name}: {price.location} {price.price_per_unit} MWK" for price in prices])
-                       response = f"CON Prices for {session_data['crop']}:\n{price_list}\n0. Back\n00. Main menu"
-               else:
-                   response = "END Invalid crop selection"
-                   USSDSession.objects.filter(session_id=session_id).delete()
-       elif level == 1.2:
-           if inputs[-1] == '0':
-               session_data['level'] = session_data['previous_levels'].pop() if session_data['previous_levels'] else 1
-               response = "CON Select crop for market prices:\n1. Maize\n2. Peas\n3. Rice\n4. Ground nuts\n0. Back\n00. Main menu"
-           elif inputs[-1] == '00':
-               session_data['level'] = 1
-               session_data['previous_levels'] = []
-               request.POST._mutable = True
-               request.POST['text'] = ''
-               response = "CON Welcome to MlimiZone Farmers\n1. See market prices\n2. List your produce\n00. Main menu"
-           else:
-               response = "END Invalid option"
-               USSDSession.objects.filter(session_id=session_id).delete()
-
-       elif level == 2.1:
-           if inputs[-1] == '0':
-               session_data['level'] = session_data['previous_levels'].pop() if session_data['previous_levels'] else 1
-               response = "CON Welcome to MlimiZone Farmers\n1. See market prices\n2. List your produce\n00. Main menu"
-           elif inputs[-1] == '00':
-               session_data['level'] = 1
-               session_data['previous_levels'] = []
-               request.POST._mutable = True
-               request.POST['text'] = ''
-               response = "CON Welcome to MlimiZone Farmers\n1. See market prices\n2. List your produce\n00. Main menu"
-           else:
-               crop_map = {'1': 'Maize', '2': 'Peas', '3': 'Rice', '4': 'Ground nuts'}
-               selected_crop = crop_map.get(inputs[-1])
-               if selected_crop:
-                   session_data['crop'] = selected_crop
-                   session_data['previous_levels'].append(2.1)
-                   session_data['level'] = 2.2
-                   response = f"CON Enter quantity in KG for {selected_crop}:\n0. Back\n00. Main menu"
-               else:
-                   response = "END Invalid crop option."
-                   USSDSession.objects.filter(session_id=session_id).delete()
-       elif level == 2.2:
-           if inputs[-1] == '0':
-               session_data['level'] = session_data['previous_levels'].pop() if session_data['previous_levels'] else 1
-               response = "CON Select crop to list:\n1. Maize\n2. Peas\n3. Rice\n4. Ground nuts\n0. Back\n00. Main menu"
-           elif inputs[-1] == '00':
-               session_data['level'] = 1
-               session_data['previous_levels'] = []
-               request.POST._mutable = True
-               request.POST['text'] = '' 
-               response = "CON Welcome to MlimiZone Farmers\n1. See market prices\n2. List your produce\n00. Main menu"
-           else:
-               try:
-                   quantity = Decimal(inputs[-1])
-                   if quantity <= 0:
-                       response = f"CON Invalid quantity. Enter a number above 0 for {session_data.get('crop')}:\n0. Back\n00. Main menu"
-                   else:
-                       crop_name = session_data.get('crop')
-                       crop = Crop.objects.get(crop_name=crop_name)
-                       price_obj = MarketPrice.objects.filter(crop=crop, location=user_region).first()
-                       if not price_obj:
-                           response = f"CON No market price for {crop_name} in {user_region}. Try another crop or contact support.\n0. Back\n00. Main menu"
-                       else:
-                           price_per_kg = price_obj.price_per_unit
-                           listing = ProduceListing.objects.create(
-                               farmer=user,
-                               crop=crop,
-                               quantity=quantity
-                           )
-                           total_price = quantity * price_per_kg
-                           message_body = f"Listed {quantity} KG of {crop_name} at {price_per_kg} MWK/kg. Total: {total_price} MWK"
-                           sms_response = send_sms(user.phone_number, message_body)
-                           SMSLogs.objects.create(
-                               user=user,
-                               message_body=message_body,
-                               status='delivered' if sms_response.get('status_code') == 200 else 'failed'
-                           )
-                           response = f"CON You have listed {quantity} KG of {crop_name} at {price_per_kg} MWK/kg. Total: {total_price} MWK.\n0. Back\n00. Main menu"
-                           session_data['level'] = 2.1
-                           session_data['previous_levels'] = [1]
-               except (ValueError, Crop.DoesNotExist):
-                   response = f"CON Invalid quantity or crop. Enter quantity in KG for {session_data.get('crop')}:\n0. Back\n00. Main menu"
-       else:
-           logger.error(f"Invalid session level: {level} for session {session_id}")
-           response = "END Invalid session state."
-           USSDSession.objects.filter(session_id=session_id).delete()
-       if 'END' not in response:
-           session.data = session_data
-           session.save()
-       logger.info(f"Sending response: {response}")
-       return HttpResponse(response, content_type='text/plain')
-   except Exception as e:
-       logger.error(f"Error in farmer_ussd_callback: {e}")
-       USSDSession.objects.filter(session_id=session_id).delete()
-       return HttpResponse("END Session error", status=500)
+def handle_book_confirm(ctx, choice):
+   if choice != '1':
+       return ctx.end("Booking cancelled.")
+   listing_id = ctx.data.get('selected_listing')
+   if not listing_id:
+       return ctx.end("Error booking.")
+   try:
+       book_listing(ctx.user, listing_id)
+   except (ListingTaken, IntegrityError):
+       return ctx.end("Sorry, this produce has already been booked.")
+   except ListingUnpriced as e:
+       logger.error(str(e))
+       return ctx.con(f"No market price available. Contact support.\n{NAV_FOOTER}")
+   ctx.reset('prices', ['main'])
+   return ctx.con(f"Booking successful. Go to Pay to complete payment.\n{NAV_FOOTER}")
 
-@csrf_exempt
-def wholesaler_ussd_callback(request):
+def render_orders(ctx):
+   orders = Order.objects.filter(wholesaler=ctx.user, status='unpaid').select_related('croplisting__crop', 'croplisting__farmer')
+   def format_order(order):
+       return f"{order.croplisting.crop.crop_name} from {order.croplisting.farmer.phone_number} - {order.croplisting.quantity} KG"
+   shown, response = ctx.paginate(orders, 'order_id', "Your unpaid orders:", format_order)
+   if not shown:
+       return ctx.end("You have no unpaid orders.")
+   ctx.data['orders'] = [order.order_id for order in shown]
+   return response
+
+def handle_order_choice(ctx, choice):
+   try:
+       selection = int(choice) - 1
+   except ValueError:
+       return ctx.end("Invalid input")
+   if not 0 <= selection < len(ctx.data.get('orders', [])):
+       return ctx.end("Invalid selection")
+   ctx.data['selected_order'] = ctx.data['orders'][selection]
+   return ctx.goto('pay_confirm')
+
+def render_pay_confirm(ctx):
+   order = Order.objects.select_related('croplisting__crop', 'croplisting__farmer').filter(order_id=ctx.data['selected_order']).first()
+   if not order:
+       return ctx.end("Invalid input")
+   return ctx.con(f"Confirm payment for {order.croplisting.crop.crop_name} from {order.croplisting.farmer.phone_number} - {order.croplisting.quantity} KG ({order.price} MWK)?\n1. Yes\n2. No\n{NAV_FOOTER}")
+
+def handle_pay_confirm(ctx, choice):
+   if choice != '1':
+       return ctx.end("Payment cancelled.")
+   order_id = ctx.data.get('selected_order')
+   if not order_id:
+       logger.error("No selected order found")
+       return ctx.end("No order selected.")
+   user = ctx.user
+   order = Order.objects.filter(order_id=order_id, wholesaler=user).first()
+   if not order:
+       return ctx.end("No order selected.")
+   if not order.price or int(float(order.price)) <= 0:
+       logger.error(f"Invalid order price for order {order_id}: {order.price}")
+       return ctx.con(f"Invalid order price. Contact support.\n{NAV_FOOTER}")
+   if not normalize_phone(user.phone_number):
+       logger.error(f"Invalid phone number for user {user.name}: {user.phone_number}")
+       return ctx.con(f"Invalid phone number. Contact support.\n{NAV_FOOTER}")
+   # The STK push itself runs after this hop has been answered (see payments.py).
+   with transaction.atomic():
+       payment = queue_payment(order)
+   if not payment:
+       return ctx.end("A payment for this order is already in progress.")
+   return ctx.end("M-Pesa payment initiated. You will receive a prompt on your phone shortly.")
+
+WHOLESALER_MENU = Menu('wholesaler', 'main', [
+   State('main', "Welcome to MlimiZone Wholesaler", [
+       ('1', 'See market prices', 'prices'),
+       ('2', 'Book produce', 'book_crop'),
+       ('3', 'Pay for orders', 'orders'),
+   ], invalid="Invalid option", footer=False),
+   *PRICE_STATES,
+   crop_state('book_crop', "Which crop do you want to book?", 'listings'),
+   State('listings', render=render_listings, handle=handle_listing_choice, paged=True),
+   State('book_confirm', render=render_book_confirm, handle=handle_book_confirm),
+   State('orders', render=render_orders, handle=handle_order_choice, paged=True),
+   State('pay_confirm', render=render_pay_confirm, handle=handle_pay_confirm),
+])
+
+ROLE_MENUS = {'farmer': FARMER_MENU, 'wholesaler': WHOLESALER_MENU}
+
+# Registration menu
+
+REGISTRATION_ROLES = {'1': 'farmer', '2': 'wholesaler'}
+DISTRICT_PROMPT = "Enter your district (e.g., Blantyre, Lilongwe, Mzimba):"
+
+def handle_role_choice(ctx, choice):
+   if choice not in REGISTRATION_ROLES:
+       return ctx.con("Invalid choice.\n1. Farmer\n2. Wholesaler")
+   ctx.data['role_choice'] = choice
+   return ctx.goto('reg_name')
+
+def handle_name(ctx, choice):
+   if not choice:
+       return ctx.con("Invalid name. Enter your full name:")
+   ctx.data['name'] = choice
+   return ctx.goto('reg_district')
+
+def handle_district(ctx, choice):
+   district = choice.title()
+   if district not in DISTRICT_TO_REGION:
+       return ctx.con(f"Invalid district. {DISTRICT_PROMPT}")
+   role = REGISTRATION_ROLES.get(ctx.data.get('role_choice'))
+   name = ctx.data.get('name')
+   if not role or not name:
+       logger.error(f"Missing role_choice or name in session_data: {ctx.data}")
+       return ctx.end("Session error. Please start over.")
+   with transaction.atomic():
+       user = User.objects.create(name=name, role=role, location=district, phone_number=ctx.phone_number)
+       queue_sms(user, f"Welcome to MlimiZone, {name}! You are registered as a {role}.")
+   return ctx.switch(ROLE_MENUS[role], user)
+
+REGISTRATION_MENU = Menu('registration', 'reg_role', [
+   State('reg_role', "Welcome to MlimiZone. Register as:", [
+       ('1', 'Farmer', 'reg_name'),
+       ('2', 'Wholesaler', 'reg_name'),
+   ], handle=handle_role_choice, footer=False),
+   State('reg_name', "Enter your full name:", footer=False, handle=handle_name),
+   State('reg_district', DISTRICT_PROMPT, footer=False, handle=handle_district),
+])
+
+# Session plumbing shared by every menu
+
+def run_menu(menu, session_id, phone_number, text, user=None):
+   store = get_session_store()
+   stored = store.load(session_id)
+   ctx = MenuContext(menu, session_id, phone_number, text, copy.deepcopy(stored), user=user)
+   response = menu.run(ctx)
+   if ctx.finished:
+       if stored is not None:
+           store.delete(session_id)
+   elif ctx.data != (stored if stored is not None else menu.initial_data()):
+       store.save(session_id, phone_number, ctx.data, created=stored is None)
+   elif stored is not None:
+       # Re-prompts leave the data as it was but still count as activity.
+       store.touch(session_id)
+   logger.info(f"Sending response: {response}")
+   return HttpResponse(response, content_type='text/plain')
+
+def role_ussd_callback(request, menu):
+   session_id = ''
    try:
        if request.method != 'POST':
            logger.warning(f"Invalid request method: {request.method}")
            return HttpResponse("Method Not Allowed", status=405)
        session_id = request.POST.get('sessionId', '')
        phone_number = normalize_phone(request.POST.get('phoneNumber', '').strip())
-       service_code = request.POST.get('serviceCode', '')
        text = request.POST.get('text', '').strip()
-       inputs = text.split('*') if text else ['']
-       logger.info(f"Received USSD request: sessionId={session_id}, phoneNumber={phone_number}, serviceCode={service_code}, text={text}")
+       logger.info(f"{menu.name} USSD request: session_id={session_id}, phone={phone_number}, text={text}")
        try:
            user = User.objects.get(phone_number=phone_number)
        except User.DoesNotExist:
@@ -333,338 +342,48 @@ def wholesaler_ussd_callback(request):
        if not user.phone_number:
            logger.error(f"User {user.name} has no phone number")
            return HttpResponse("END Invalid user phone number. Contact support.", content_type='text/plain')
-       user_region = DISTRICT_TO_REGION.get(user.location, 'Southern Region')
-       try:
-           session = USSDSession.objects.get(session_id=session_id)
-           session_data = session.data or {'level': 1, 'previous_levels': []}
-       except USSDSession.DoesNotExist:
-           session_data = {'level': 1, 'previous_levels': []}
-           session = USSDSession.objects.create(session_id=session_id, phone_number=phone_number, data=session_data)
-       response = "END Invalid session state." 
-       if session_data.get('level') == 1:
-           if not text:
-               response = "CON Welcome to MlimiZone Wholesaler\n1. See market prices\n2. Book produce\n3. Pay for orders"
-           elif inputs[-1] == '1':
-               session_data['previous_levels'].append(1)
-               session_data['level'] = 1.1
-               response = "CON Select crop for market prices:\n1. Maize\n2. Peas\n3. Rice\n4. Ground nuts\n0. Back\n00. Main menu"
-           elif inputs[-1] == '2':
-               session_data['previous_levels'].append(1)
-               session_data['level'] = 2
-               response = "CON Which crop do you want to book?\n1. Maize\n2. Peas\n3. Rice\n4. Ground nuts\n0. Back\n00. Main menu"
-           elif inputs[-1] == '3':
-               session_data['previous_levels'].append(1)
-               session_data['level'] = 5
-               orders = Order.objects.filter(wholesaler=user, status='unpaid')
-               if not orders:
-                   response = "END You have no unpaid orders."
-                   USSDSession.objects.filter(session_id=session_id).delete()
-               else:
-                   session_data['orders'] = [order.order_id for order in orders]
-                   order_list = "\n".join([f"{i+1}. {order.croplisting.crop.crop_name} from {order.croplisting.farmer.phone_number} - {order.croplisting.quantity} KG" for i, order in enumerate(orders)])
-                   response = f"CON Your unpaid orders:\n{order_list}\n0. Back\n00. Main menu"
-           elif inputs[-1] == '00':
-               session_data['level'] = 1
-               session_data['previous_levels'] = []
-               request.POST._mutable = True
-               request.POST['text'] = '' 
-               response = "CON Welcome to MlimiZone Wholesaler\n1. See market prices\n2. Book produce\n3. Pay for orders\n00. Main menu"
-           else:
-               response = "END Invalid option"
-               USSDSession.objects.filter(session_id=session_id).delete()
-       elif session_data.get('level') == 1.1:
-           if inputs[-1] == '0':
-               session_data['level'] = session_data['previous_levels'].pop() if session_data['previous_levels'] else 1
-               response = "CON Welcome to MlimiZone Wholesaler\n1. See market prices\n2. Book produce\n3. Pay for orders\n00. Main menu"
-           elif inputs[-1] == '00':
-               session_data['level'] = 1
-               session_data['previous_levels'] = []
-               request.POST._mutable = True
-               request.POST['text'] = ''
-               response = "CON Welcome to MlimiZone Wholesaler\n1. See market prices\n2. Book produce\n3. Pay for orders\n00. Main menu"
-           else:
-               crop_map = {'1': 'Maize', '2': 'Peas', '3': 'Rice', '4': 'Ground nuts'}
-               if inputs[-1] in crop_map:
-                   session_data['crop'] = crop_map[inputs[-1]]
-                   session_data['previous_levels'].append(1.1)
-                   session_data['level'] = 1.2
-                   prices = MarketPrice.objects.filter(crop__crop_name=session_data['crop']).order_by('location')
-                   if not prices:
-                       response = f"CON No prices available for {session_data['crop']}.\n0. Back\n00. Main menu"
-                   else:
-                       price_list = "\n".join([f"{price.crop.crop_name}: {price.location} {price.price_per_unit} MWK" for price in prices])
-                       response = f"CON Prices for {session_data['crop']}:\n{price_list}\n0. Back\n00. Main menu"
-               else:
-                   response = "END Invalid crop selection"
-                   USSDSession.objects.filter(session_id=session_id).delete()
-       elif session_data.get('level') == 1.2:
-           if inputs[-1] == '0':
-               session_data['level'] = session_data['previous_levels'].pop() if session_data['previous_levels'] else 1
-               response = "CON Select crop for market prices:\n1. Maize\n2. Peas\n3. Rice\n4. Ground nuts\n0. Back\n00. Main menu"
-           elif inputs[-1] == '00':
-               session_data['level'] = 1
-               session_data['previous_levels'] = []
-               request.POST._mutable = True
-               request.POST['text'] = '' 
-               response = "CON Welcome to MlimiZone Wholesaler\n1. See market prices\n2. Book produce\n3. Pay for orders\n00. Main menu"
-           else:
-               response = "END Invalid option"
-               USSDSession.objects.filter(session_id=session_id).delete()
-       elif session_data.get('level') == 2:
-           if inputs[-1] == '0':
-               session_data['level'] = session_data['previous_levels'].pop() if session_data['previous_levels'] else 1
-               response = "CON Welcome to MlimiZone Wholesaler\n1. See market prices\n2. Book produce\n3. Pay for orders\n00. Main menu"
-           elif inputs[-1] == '00':
-               session_data['level'] = 1
-               session_data['previous_levels'] = []
-               request.POST._mutable = True
-               request.POST['text'] = ''
-               response = "CON Welcome to MlimiZone Wholesaler\n1. See market prices\n2. Book produce\n3. Pay for orders\n00. Main menu"
-           else:
-               crop_map = {'1': 'Maize', '2': 'Peas', '3': 'Rice', '4': 'Ground nuts'}
-               if inputs[-1] in crop_map:
-                   session_data['crop'] = crop_map[inputs[-1]]
-                   session_data['previous_levels'].append(2)
-                   session_data['level'] = 3
-                   try:
-                       crop = Crop.objects.get(crop_name=session_data['crop'])
-                       listings = ProduceListing.objects.filter(crop=crop).exclude(order__isnull=False)
-                       if not listings:
-                           response = f"END No available {session_data['crop']} listings."
-                           USSDSession.objects.filter(session_id=session_id).delete()
-                       else:
-                           session_data['listings'] = [listing.croplisting_id for listing in listings]
-                           listing_str = "\n".join([f"{i+1}. {listing.farmer.phone_number} - {listing.quantity} KG at {MarketPrice.objects.filter(crop=crop, location=DISTRICT_TO_REGION.get(listing.farmer.location, 'Southern Region')).first().price_per_unit} MWK" for i, listing in enumerate(listings)])
-                           response = f"CON Available {session_data['crop']} for sale:\n{listing_str}\n0. Back\n00. Main menu"
-                   except Crop.DoesNotExist:
-                       response = "END Invalid crop."
-                       USSDSession.objects.filter(session_id=session_id).delete()
-               else:
-                   response = "END Invalid crop selection"
-                   USSDSession.objects.filter(session_id=session_id).delete()
-       elif session_data.get('level') == 3:
-           if inputs[-1] == '0':
-               session_data['level'] = session_data['previous_levels'].pop() if session_data['previous_levels'] else 1
-               response = "CON Which crop do you want to book?\n1. Maize\n2. Peas\n3. Rice\n4. Ground nuts\n0. Back\n00. Main menu"
-           elif inputs[-1] == '00':
-               session_data['level'] = 1
-               session_data['previous_levels'] = []
-               request.POST._mutable = True
-               request.POST['text'] = ''
-               response = "CON Welcome to MlimiZone Wholesaler\n1. See market prices\n2. Book produce\n3. Pay for orders\n00. Main menu"
-           else:
-               try:
-                   selection = int(inputs[-1]) - 1
-                   if 0 <= selection < len(session_data.get('listings', [])):
-                       listing_id = session_data['listings'][selection]
-                       listing = ProduceListing.objects.get(croplisting_id=listing_id)
-                       session_data['selected_listing'] = listing_id
-                       session_data['previous_levels'].append(3)
-                       session_data['level'] = 4
-                       price_per_kg = MarketPrice.objects.filter(crop=listing.crop, location=DISTRICT_TO_REGION.get(listing.farmer.location, 'Southern Region')).first()
-                       if not price_per_kg:
-                           logger.error(f"No price found for crop {listing.crop.crop_name} in {DISTRICT_TO_REGION.get(listing.farmer.location, 'Southern Region')}")
-                           response = "CON No market price available. Contact support.\n0. Back\n00. Main menu"
-                       else:
-                           price_per_kg = price_per_kg.price_per_unit
-                           response = f"CON Confirm booking for {listing.crop.crop_name} from {listing.farmer.phone_number} - {listing.quantity} KG at {price_per_kg} MWK?\n1. Yes\n2. No\n0. Back\n00. Main menu"
-                   else:
-                       response = "END Invalid selection"
-                       USSDSession.objects.filter(session_id=session_id).delete()
-               except (ValueError, ProduceListing.DoesNotExist):
-                   response = "END Invalid input"
-                   USSDSession.objects.filter(session_id=session_id).delete()
-       elif session_data.get('level') == 4:
-           if inputs[-1] == '0':
-               session_data['level'] = session_data['previous_levels'].pop() if session_data['previous_levels'] else 1
-               try:
-                   crop = Crop.objects.get(crop_name=session_data.get('crop', 'Maize'))
-                   listings = ProduceListing.objects.filter(crop=crop).exclude(order__isnull=False)
-                   if not listings:
-                       response = f"END No available {session_data.get('crop', 'Maize')} listings."
-                       USSDSession.objects.filter(session_id=session_id).delete()
-                   else:
-                       session_data['listings'] = [listing.croplisting_id for listing in listings]
-                       listing_str = "\n".join([f"{i+1}. {listing.farmer.phone_number} - {listing.quantity} KG at {MarketPrice.objects.filter(crop=crop, location=DISTRICT_TO_REGION.get(listing.farmer.location, 'Southern Region')).first().price_per_unit} MWK" for i, listing in enumerate(listings)])
-                       response = f"CON Available {session_data['crop']} for sale:\n{listing_str}\n0. Back\n00. Main menu"
-               except Crop.DoesNotExist:
-                   response = "END Invalid crop."
-                   USSDSession.objects.filter(session_id=session_id).delete()
-           elif inputs[-1] == '00':
-               session_data['level'] = 1
-               session_data['previous_levels'] = []
-               request.POST._mutable = True
-               request.POST['text'] = '' 
-               response = "CON Welcome to MlimiZone Wholesaler\n1. See market prices\n2. Book produce\n3. Pay for orders\n00. Main menu"
-           else:
-               if inputs[-1] == '1':
-                   listing_id = session_data.get('selected_listing')
-                   if listing_id:
-                       try:
-                           listing = ProduceListing.objects.get(croplisting_id=listing_id)
-                           cart, created = Cart.objects.get_or_create(wholesaler=user)
-                           price_per_kg = MarketPrice.objects.filter(crop=listing.crop, location=DISTRICT_TO_REGION.get(listing.farmer.location, 'Southern Region')).first()
-                           if not price_per_kg:
-                               logger.error(f"No price found for crop {listing.crop.crop_name} in {DISTRICT_TO_REGION.get(listing.farmer.location, 'Southern Region')}")
-                               response = "CON No market price available. Contact support.\n0. Back\n00. Main menu"
-                           else:
-                               price_per_kg = price_per_kg.price_per_unit
-                               order = Order.objects.create(
-                                   cart=cart,
-                                   wholesaler=user,
-                                   croplisting=listing,
-                                   price=listing.quantity * price_per_kg,
-                                   status='unpaid'
-                               )
-                               message_body = f"Booked {listing.quantity} KG of {listing.crop.crop_name} from {listing.farmer.phone_number} for {order.price} MWK"
-                               sms_response = send_sms(user.phone_number, message_body)
-                               SMSLogs.objects.create(
-                                   user=user,
-                                   message_body=message_body,
-                                   status='delivered' if sms_response.get('status_code') == 200 else 'failed'
-                               )
-                               farmer_message = f"Hello, your {listing.quantity} KG of {listing.crop.crop_name} has been booked by {user.name}. Expect payment of {order.price} MWK soon."
-                               farmer_sms = send_sms(listing.farmer.phone_number, farmer_message)
-                               SMSLogs.objects.create(
-                                   user=listing.farmer,
-                                   message_body=farmer_message,
-                                   status='delivered' if farmer_sms.get('status_code') == 200 else 'failed'
-                               )
-                               response = f"CON Booking successful. Go to Pay to complete payment.\n0. Back\n00. Main menu"
-                               session_data['level'] = 1.1
-                               session_data['previous_levels'] = [1]
-                       except (ProduceListing.DoesNotExist, Cart.DoesNotExist) as e:
-                           logger.error(f"Booking error: {str(e)}")
-                           response = "END Error booking."
-                           USSDSession.objects.filter(session_id=session_id).delete()
-                   else:
-                       response = "END Error booking."
-                       USSDSession.objects.filter(session_id=session_id).delete()
-               else:
-                   response = "END Booking cancelled."
-                   USSDSession.objects.filter(session_id=session_id).delete()
-       elif session_data.get('level') == 5:
-           if inputs[-1] == '0':
-               session_data['level'] = session_data['previous_levels'].pop() if session_data['previous_levels'] else 1
-               response = "CON Welcome to MlimiZone Wholesaler\n1. See market prices\n2. Book produce\n3. Pay for orders\n00. Main menu"
-           elif inputs[-1] == '00':
-               session_data['level'] = 1
-               session_data['previous_levels'] = []
-               request.POST._mutable = True
-               request.POST['text'] = '' 
-               response = "CON Welcome to MlimiZone Wholesaler\n1. See market prices\n2. Book produce\n3. Pay for orders\n00. Main menu"
-           else:
-               try:
-                   selection = int(inputs[-1]) - 1
-                   if 0 <= selection < len(session_data.get('orders', [])):
-                       order_id = session_data['orders'][selection]
-                       order = Order.objects.get(order_id=order_id)
-                       session_data['selected_order'] = order_id
-                       session_data['previous_levels'].append(5)
-                       session_data['level'] = 6
-                       response = f"CON Confirm payment for {order.croplisting.crop.crop_name} from {order.croplisting.farmer.phone_number} - {order.croplisting.quantity} KG ({order.price} MWK)?\n1. Yes\n2. No\n0. Back\n00. Main menu"
-                   else:
-                       response = "END Invalid selection"
-                       USSDSession.objects.filter(session_id=session_id).delete()
-               except (ValueError, Order.DoesNotExist):
-                   response = "END Invalid input"
-                   USSDSession.objects.filter(session_id=session_id).delete()
-       elif session_data.get('level') == 6:
-           if inputs[-1] == '0':
-               session_data['level'] = session_data['previous_levels'].pop() if session_data['previous_levels'] else 1
-               orders = Order.objects.filter(wholesaler=user, status='unpaid')
-               if not orders:
-                   response = "END You have no unpaid orders."
-                   USSDSession.objects.filter(session_id=session_id).delete()
-               else:
-                   session_data['orders'] = [order.order_id for order in orders]
-                   order_list = "\n".join([f"{i+1}. {order.croplisting.crop.crop_name} from {order.croplisting.farmer.phone_number} - {order.croplisting.quantity} KG" for i, order in enumerate(orders)])
-                   response = f"CON Your unpaid orders:\n{order_list}\n0. Back\n00. Main menu"
-           elif inputs[-1] == '00':
-               session_data['level'] = 1
-               session_data['previous_levels'] = []
-               request.POST._mutable = True
-               request.POST['text'] = '' 
-               response = "CON Welcome to MlimiZone Wholesaler\n1. See market prices\n2. Book produce\n3. Pay for orders\n00. Main menu"
-           else:
-               if inputs[-1] == '1':
-                   order_id = session_data.get('selected_order')
-                   if not order_id:
-                       logger.error("No selected order found")
-                       response = "END No order selected."
-                       USSDSession.objects.filter(session_id=session_id).delete()
-                   else:
-                       try:
-                           order = Order.objects.get(order_id=order_id)
-                           if not order.price or order.price <= 0:
-                               logger.error(f"Invalid order price for order {order_id}: {order.price}")
-                               response = "CON Invalid order price. Contact support.\n0. Back\n00. Main menu"
-                           else:
-                               phone_number = normalize_phone(user.phone_number)
-                               if not phone_number:
-                                   logger.error(f"Invalid phone number for user {user.name}: {user.phone_number}")
-                                   response = "CON Invalid phone number. Contact support.\n0. Back\n00. Main menu"
-                               else:
-                                   amount = int(float(order.price))
-                                   if amount <= 0:
-                                       logger.error(f"Invalid payment amount: {amount}")
-                                       response = "CON Invalid payment amount. Contact support.\n0. Back\n00. Main menu"
-                                   else:
-                                       daraja = DarajaClient()
-                                       stk_response = daraja.stk_push(
-                                           phone_number=phone_number,
-                                           amount=amount,
-                                           account_reference=f"Order_{order.order_id}",
-                                           transaction_desc=f"Payment for {order.croplisting.crop.crop_name}"
-                                       )
-                                       logger.info(f"STK Push request: phone={phone_number}, amount={amount}")
-                                       logger.info(f"STK Push response: {stk_response}")
-                                       if 'ResponseCode' in stk_response and stk_response['ResponseCode'] == '0':
-                                           Payment.objects.create(
-                                               order=order,
-                                               amount=order.price,
-                                               payment_status='pending',
-                                               transaction_ref=stk_response['CheckoutRequestID']
-                                           )
-                                           message_body = f"M-Pesa payment of {order.price} MWK for order {order.order_id} initiated. Check your phone."
-                                           sms_response = send_sms(user.phone_number, message_body)
-                                           SMSLogs.objects.create(
-                                               user=user,
-                                               message_body=message_body,
-                                               status='delivered' if sms_response.get('status_code') == 200 else 'failed'
-                                           )
-                                           farmer_message = f"Payment of {order.price} MWK for {order.croplisting.quantity} KG of {order.croplisting.crop.crop_name} initiated by {user.name}."
-                                           farmer_sms = send_sms(order.croplisting.farmer.phone_number, farmer_message)
-                                           SMSLogs.objects.create(
-                                               user=order.croplisting.farmer,
-                                               message_body=farmer_message,
-                                               status='delivered' if farmer_sms.get('status_code') == 200 else 'failed'
-                                           )
-                                           response = "END M-Pesa payment initiated."
-                                           USSDSession.objects.filter(session_id=session_id).delete()
-                                       else:
-                                           error_message = stk_response.get('error', 'Unknown error')
-                                           logger.error(f"STK Push failed: {error_message}")
-                                           response = f"CON Payment failed: {error_message}. Try again.\n0. Back\n00. Main menu"
-                       except Exception as payment_error:
-                           logger.error(f"Payment error: {str(payment_error)}")
-                           response = f"CON Something went wrong while processing payment: {str(payment_error)}. Try again.\n0. Back\n00. Main menu"
-               else:
-                   response = "END Payment cancelled."
-                   USSDSession.objects.filter(session_id=session_id).delete()
-       else:
-           logger.error(f"Invalid session level: {session_data.get('level')} for session {session_id}")
-           response = "END Invalid session state."
-           USSDSession.objects.filter(session_id=session_id).delete()
-       if 'END' not in response:
-           session.data = session_data
-           session.save()
-       logger.info(f"Sending response: {response}")
-       return HttpResponse(response, content_type='text/plain')
+       return run_menu(menu, session_id, phone_number, text, user=user)
    except Exception as e:
-       logger.error(f"Error in wholesaler_ussd_callback: {str(e)}")
+       logger.error(f"Error in {menu.name} USSD menu: {str(e)}")
        try:
-           USSDSession.objects.filter(session_id=session_id).delete()
+           get_session_store().delete(session_id)
        except Exception as cleanup_error:
            logger.error(f"Error cleaning up session: {str(cleanup_error)}")
-       return HttpResponse("END Session error", status=500)
\ No newline at end of file
+       return HttpResponse("END Session error", status=500)
+
+class USSDView(APIView):
+   permission_classes = []
+
+   def post(self, request, *args, **kwargs):
+       logger.info(f"Received request: {request.data or request.POST}")
+       session_id = request.data.get('sessionId') or request.POST.get('sessionId')
+       service_code = request.data.get('serviceCode') or request.POST.get('serviceCode')
+       phone = normalize_phone(request.data.get('phoneNumber') or request.POST.get('phoneNumber'))
+       if not phone.startswith('254') or len(phone) != 12:
+           logger.error(f"Invalid phone number format: {phone}")
+           return HttpResponse("END Invalid phone number format. Use 254XXXXXXXXX.", content_type='text/plain')
+       text = (request.data.get('text') or request.POST.get('text') or '').strip()
+       logger.info(f"Parsed: sessionId={session_id}, serviceCode={service_code}, phoneNumber={phone}, text={text}")
+
+       user = User.objects.filter(phone_number=phone).first()
+
+       if not user:
+           return self.handle_registration(text, phone, session_id)
+
+       if user.role == 'farmer':
+           return farmer_ussd_callback(request)
+       elif user.role == 'wholesaler':
+           return wholesaler_ussd_callback(request)
+       else:
+           return HttpResponse('END Role not supported.', content_type='text/plain')
+
+   def handle_registration(self, text, phone, session_id):
+       return run_menu(REGISTRATION_MENU, session_id, phone, text)
+
+@csrf_exempt
+def farmer_ussd_callback(request):
+   return role_ussd_callback(request, FARMER_MENU)
+
+@csrf_exempt
+def wholesaler_ussd_callback(request):
+   return role_ussd_callback(request, WHOLESALER_MENU)
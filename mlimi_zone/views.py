@@ -1,78 +1,188 @@
 from rest_framework import viewsets, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.http import HttpResponse 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from rest_framework.decorators import action
+from rest_framework.parsers import FileUploadParser, MultiPartParser
 from rest_framework.permissions import AllowAny
-from .models import ProduceListing, Cart, Order, Payment, MarketPrice, Crop, SMSLogs
+from .models import ProduceListing, Cart, Order, Payment, MarketPrice, MarketPriceRollup, Crop, PaymentCallback, User, PRICE_ROLLUP_PERIOD_CHOICES
 from .serializers import (
     ProduceListingSerializer, CartSerializer, OrderSerializer,
-    PaymentSerializer, MarketPriceSerializer, CropSerializer
+    PaymentSerializer, MarketPriceSerializer, CropSerializer, PriceRollupSerializer,
+    ProduceListingBulkItemSerializer
 )
 from .permissions import (
     FarmerListingPermission, WholesalerCartPermission,
     OrderPermission, PaymentPermission, IsProjectAdmin
 )
-from .sms import send_sms
+from .caching import get_version, last_modified
+from .price_import import import_prices, iter_price_rows, text_stream
+from .exports import ExportError, FORMATS, export_lines
+from .payments import apply_stk_callback, parse_stk_callback, record_callback
+import hashlib
 import logging
 
 logger = logging.getLogger(__name__)
 
 class ProduceListingViewSet(viewsets.ModelViewSet):
-    queryset = ProduceListing.objects.all()
+    queryset = ProduceListing.objects.select_related('farmer')
     serializer_class = ProduceListingSerializer
     permission_classes = [FarmerListingPermission]
 
     def get_queryset(self):
         user = self.request.user
+        queryset = super().get_queryset()
+        if self.request.query_params.get('available', '').lower() in ('1', 'true'):
+            queryset = queryset.available()
         if getattr(user, 'role', None) == 'farmer':
-            return ProduceListing.objects.filter(farmer=user)
-        return super().get_queryset()
+            return queryset.filter(farmer=user)
+        return queryset
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk_create(self, request):
+        # Takes a JSON array of {farmer_id, crop, quantity}. Valid items are
+        # inserted together; each item gets its own result, in request order.
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response({'detail': "Send a non-empty JSON array of listings."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.API_BULK_MAX_ITEMS:
+            return Response({'detail': f"At most {settings.API_BULK_MAX_ITEMS} listings per request."}, status=status.HTTP_400_BAD_REQUEST)
+        results = []
+        valid = []
+        for index, item in enumerate(items):
+            serializer = ProduceListingBulkItemSerializer(data=item)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+                results.append(None)
+            else:
+                results.append({'index': index, 'status': 'invalid', 'errors': serializer.errors})
+        farmer_ids = set(User.objects.filter(
+            role='farmer', pk__in={data['farmer_id'] for _, data in valid}
+        ).values_list('pk', flat=True))
+        crop_ids = set(Crop.objects.filter(pk__in={data['crop'] for _, data in valid}).values_list('pk', flat=True))
+        listings = []
+        for index, data in valid:
+            errors = {}
+            if data['farmer_id'] not in farmer_ids:
+                errors['farmer_id'] = [f"Invalid pk \"{data['farmer_id']}\" - object does not exist."]
+            if data['crop'] not in crop_ids:
+                errors['crop'] = [f"Invalid pk \"{data['crop']}\" - object does not exist."]
+            if errors:
+                results[index] = {'index': index, 'status': 'invalid', 'errors': errors}
+            else:
+                listings.append((index, ProduceListing(farmer_id=data['farmer_id'], crop_id=data['crop'], quantity=data['quantity'])))
+        with transaction.atomic():
+            ProduceListing.objects.bulk_create([listing for _, listing in listings])
+        for index, listing in listings:
+            results[index] = {'index': index, 'status': 'created', 'croplisting_id': listing.pk}
+        failed = len(items) - len(listings)
+        if not listings:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif failed:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response({'created': len(listings), 'failed': failed, 'results': results}, status=response_status)
 
 class CartViewSet(viewsets.ModelViewSet):
-    queryset = Cart.objects.all()
+    queryset = Cart.objects.select_related('wholesaler').prefetch_related(
+        Prefetch('orders', queryset=Order.objects.select_related('croplisting__farmer'))
+    )
     serializer_class = CartSerializer
     permission_classes = [WholesalerCartPermission]
 
     def get_queryset(self):
         user = self.request.user
         if getattr(user, 'role', None) == 'wholesaler':
-            return Cart.objects.filter(wholesaler=user)
+            return super().get_queryset().filter(wholesaler=user)
         return Cart.objects.none()
 
     def destroy(self, request, *args, **kwargs):
         return Response({'detail': 'Cart deletion not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 class OrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all()
+    # OrderSerializer nests croplisting -> farmer and OrderPermission compares both parties.
+    queryset = Order.objects.select_related('croplisting__farmer', 'wholesaler')
     serializer_class = OrderSerializer
     permission_classes = [OrderPermission]
 
     def get_queryset(self):
         user = self.request.user
         if getattr(user, 'role', None) == 'wholesaler':
-            return Order.objects.filter(wholesaler=user)
+            return super().get_queryset().filter(wholesaler=user)
         if getattr(user, 'role', None) == 'farmer':
-            return Order.objects.filter(croplisting__farmer=user)
+            return super().get_queryset().filter(croplisting__farmer=user)
         return Order.objects.none()
 
 class PaymentViewSet(viewsets.ModelViewSet):
-    queryset = Payment.objects.all()
+    # PaymentPermission walks order -> croplisting -> farmer and order -> wholesaler.
+    queryset = Payment.objects.select_related('order__croplisting__farmer', 'order__wholesaler')
     serializer_class = PaymentSerializer
     permission_classes = [PaymentPermission]
 
     def get_queryset(self):
         user = self.request.user
         if getattr(user, 'role', None) == 'wholesaler':
-            return Payment.objects.filter(order__wholesaler=user)
+            return super().get_queryset().filter(order__wholesaler=user)
         if getattr(user, 'role', None) == 'farmer':
-            return Payment.objects.filter(order__croplisting__farmer=user)
+            return super().get_queryset().filter(order__croplisting__farmer=user)
         return Payment.objects.none()
 
-class MarketPriceViewSet(viewsets.ModelViewSet):
-    queryset = MarketPrice.objects.all()
+class VersionedConditionalGetMixin:
+    # list/retrieve are answered from the table version stamps in caching.py:
+    # a matching If-None-Match / If-Modified-Since gets a 304 without a query
+    # or serializer, and 200s carry validators plus a public Cache-Control.
+    cache_versions = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_get(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_get(request, super().retrieve, *args, **kwargs)
+
+    def conditional_get(self, request, handler, *args, **kwargs):
+        versions = [get_version(name) for name in self.cache_versions]
+        fingerprint = f"{versions}:{request.get_full_path()}:{request.META.get('HTTP_ACCEPT', '')}"
+        etag = quote_etag(hashlib.md5(fingerprint.encode()).hexdigest())
+        modified = int(max(last_modified(name) for name in self.cache_versions))
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified)
+        patch_cache_control(response, public=True, max_age=settings.API_CACHE_MAX_AGE)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+class MarketPriceViewSet(VersionedConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = MarketPrice.objects.select_related('crop')
     serializer_class = MarketPriceSerializer
+    cache_versions = ('marketprice',)
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser, FileUploadParser])
+    def bulk_import(self, request):
+        # Admin-only (see get_permissions); the upload is read in chunks from
+        # Django's temporary file, never parsed as a whole.
+        upload = request.data.get('file')
+        if upload is None:
+            return Response({'detail': "Upload the price sheet as 'file'."}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.query_params.get('type') or ('csv' if upload.name.lower().endswith('.csv') else 'json')
+        if file_format not in ('csv', 'json'):
+            return Response({'detail': "type must be csv or json."}, status=status.HTTP_400_BAD_REQUEST)
+        result = import_prices(iter_price_rows(text_stream(upload.file), file_format))
+        return Response(result, status=status.HTTP_200_OK if not result['failed'] else status.HTTP_207_MULTI_STATUS)
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
@@ -80,15 +190,63 @@ class MarketPriceViewSet(viewsets.ModelViewSet):
         return [IsProjectAdmin()]
 
 
-class CropViewSet(viewsets.ModelViewSet):
+class CropViewSet(VersionedConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Crop.objects.all()
     serializer_class = CropSerializer
+    cache_versions = ('crop',)
+    cursor_ordering = ('crop_id',)
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
             return [AllowAny()]
         return [IsProjectAdmin()]
 
+class PriceRollupViewSet(VersionedConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    # Daily/weekly price trends served from the rollups; rollups change in the
+    # same transaction as MarketPrice, so the 'marketprice' stamp covers them.
+    queryset = MarketPriceRollup.objects.select_related('crop')
+    serializer_class = PriceRollupSerializer
+    permission_classes = [AllowAny]
+    cache_versions = ('marketprice', 'crop')
+    cursor_ordering = ('-period_start', '-rollup_id')
+
+    def get_queryset(self):
+        params = self.request.query_params
+        period = params.get('period', 'week')
+        if period not in dict(PRICE_ROLLUP_PERIOD_CHOICES):
+            raise ValidationError({'period': f"Use one of {', '.join(dict(PRICE_ROLLUP_PERIOD_CHOICES))}."})
+        queryset = super().get_queryset().filter(period=period)
+        if params.get('crop_id'):
+            if not params['crop_id'].isdigit():
+                raise ValidationError({'crop_id': "Use a numeric crop id."})
+            queryset = queryset.filter(crop_id=int(params['crop_id']))
+        if params.get('location'):
+            queryset = queryset.filter(location=params['location'])
+        for param, lookup in (('since', 'period_start__gte'), ('until', 'period_start__lte')):
+            if params.get(param):
+                day = parse_date(params[param])
+                if day is None:
+                    raise ValidationError({param: "Use YYYY-MM-DD."})
+                queryset = queryset.filter(**{lookup: day})
+        return queryset
+
+class ExportView(APIView):
+    # Admin-only CSV/NDJSON dumps of orders, payments and SMS logs, streamed
+    # row by row instead of paged through the API or the admin.
+    permission_classes = [IsProjectAdmin]
+
+    def get(self, request, name):
+        params = request.query_params
+        file_format = params.get('type', 'csv')
+        try:
+            lines = export_lines(name, file_format, params.get('since'), params.get('until'), params.get('status'))
+        except ExportError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(lines, content_type=FORMATS[file_format])
+        stamp = timezone.now().strftime('%Y%m%d%H%M%S')
+        response['Content-Disposition'] = f'attachment; filename="{name}-{stamp}.{file_format}"'
+        return response
+
 @method_decorator(csrf_exempt, name='dispatch')
 class PaymentCallbackView(APIView):
     authentication_classes = [] 
@@ -99,54 +257,32 @@ class PaymentCallbackView(APIView):
 
     def post(self, request):
         logger.info(f"Incoming M-Pesa callback data: {request.data}")
+        body = request.data.dict() if hasattr(request.data, 'dict') else request.data
+
+        try:
+            entry = record_callback(body)
+        except Exception as e:
+            logger.error(f"Could not store M-Pesa callback: {str(e)}", exc_info=True)
+            entry = None
+        if entry and settings.PAYMENT_CALLBACK_BUFFERED:
+            return HttpResponse("OK")
 
         try:
-            stk_callback = request.data.get('Body', {}).get('stkCallback', {})
-            checkout_id = stk_callback.get('CheckoutRequestID')
-            result_code = stk_callback.get('ResultCode')
-            result_desc = stk_callback.get('ResultDesc', 'No description')
+            checkout_id, result_code, result_desc = parse_stk_callback(body)
 
             if not checkout_id:
                 logger.error("Missing CheckoutRequestID in callback")
-                return HttpResponse("OK") 
-
-            payment = Payment.objects.filter(transaction_ref=checkout_id).first()
-            if not payment:
-                logger.warning(f"Payment with CheckoutRequestID {checkout_id} not found")
+                if entry:
+                    PaymentCallback.objects.filter(pk=entry.pk).update(applied_at=timezone.now())
                 return HttpResponse("OK")
 
-            if result_code == 0:
-                payment.payment_status = 'completed'
-                payment.order.status = 'paid'
-                payment.order.save()
-
-                message_body = f"Payment of {payment.amount} MWK for order {payment.order.order_id} confirmed."
-                sms_response = send_sms(payment.order.wholesaler.phone_number, message_body)
-                SMSLogs.objects.create(
-                    user=payment.order.wholesaler,
-                    message_body=message_body,
-                    status='delivered' if sms_response.get('status_code') == 200 else 'failed'
-                )
-
-                farmer_message = (
-                    f"Payment of {payment.amount} MWK for "
-                    f"{payment.order.croplisting.quantity} KG of "
-                    f"{payment.order.croplisting.crop.crop_name} confirmed."
-                )
-                farmer_sms = send_sms(payment.order.croplisting.farmer.phone_number, farmer_message)
-                SMSLogs.objects.create(
-                    user=payment.order.croplisting.farmer,
-                    message_body=farmer_message,
-                    status='delivered' if farmer_sms.get('status_code') == 200 else 'failed'
-                )
-            else:
-                payment.payment_status = 'failed'
-                logger.warning(f"Payment failed: {result_code} - {result_desc}")
-
-            payment.save()
-            logger.info(f"Payment {checkout_id} updated to status: {payment.payment_status}")
+            new_status = apply_stk_callback(checkout_id, result_code, result_desc)
+            if new_status:
+                logger.info(f"Payment {checkout_id} updated to status: {new_status}")
+            if entry:
+                PaymentCallback.objects.filter(pk=entry.pk).update(applied_at=timezone.now())
 
         except Exception as e:
             logger.error(f"Error processing M-Pesa callback: {str(e)}", exc_info=True)
 
-        return HttpResponse("OK")
\ No newline at end of file
+        return HttpResponse("OK")
@@ -100,6 +100,24 @@ DATABASES = {
 }
 
 
+# Cache
+# Version stamps here invalidate rendered USSD menus, API ETags and the crop
+# catalog, and hold the Daraja token lock, so the default backend is shared
+# by every worker process on the host. Point CACHE_BACKEND/CACHE_LOCATION at
+# memcached or redis when workers span hosts; locmem is per-process and only
+# fit for a single dev server (check mlimi_zone.W001 warns about it).
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / '.cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+        },
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -141,8 +159,51 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# List endpoints page with opaque cursors over (created_at, pk); clients may ask
+# for up to API_MAX_PAGE_SIZE rows with ?page_size=.
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'mlimi_zone.pagination.CreatedAtCursorPagination',
+    'PAGE_SIZE': int(os.getenv('API_PAGE_SIZE', 50)),
+}
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', 500))
+
+# Largest array accepted by bulk endpoints such as POST croplistings/bulk/.
+API_BULK_MAX_ITEMS = int(os.getenv('API_BULK_MAX_ITEMS', 1000))
+
+# Seconds a CDN or client may reuse public market-price and crop responses
+# before revalidating with their ETag.
+API_CACHE_MAX_AGE = int(os.getenv('API_CACHE_MAX_AGE', 60))
+
 ALLOWED_ADMIN_IDENTIFIERS= os.getenv("ALLOWED_ADMIN_IDENTIFIERS", "").split(",")
 
 USERNAME_SMS = os.getenv("USERNAME_SMS")
 PASSWORD = os.getenv("PASSWORD")
 SOURCE = os.getenv("SOURCE")
+
+# Threads per web worker that send STK pushes after the USSD hop is answered.
+# 0 leaves queued payments to the process_payment_intents command.
+STK_PUSH_WORKERS = int(os.getenv('STK_PUSH_WORKERS', 4))
+
+# When true the M-Pesa callback view only appends the raw body to PaymentCallback
+# and apply_payment_callbacks updates payments in batches. Otherwise callbacks are
+# still logged but applied inline.
+PAYMENT_CALLBACK_BUFFERED = os.getenv('PAYMENT_CALLBACK_BUFFERED', 'False').lower() == 'true'
+
+# Longest USSD screen the aggregator will deliver; list menus paginate to fit.
+USSD_MAX_RESPONSE_CHARS = int(os.getenv('USSD_MAX_RESPONSE_CHARS', 182))
+
+# USSD session state lives for a couple of minutes per dial. Backends:
+# mlimi_zone.sessions.DatabaseSessionStore (USSDSession table),
+# mlimi_zone.sessions.MemorySessionStore (per-process LRU, single worker only),
+# mlimi_zone.sessions.CacheSessionStore (any Django cache, shared across workers).
+USSD_SESSION_STORE = {
+    'BACKEND': os.getenv('USSD_SESSION_BACKEND', 'mlimi_zone.sessions.DatabaseSessionStore'),
+    'TTL': int(os.getenv('USSD_SESSION_TTL', 180)),
+    'OPTIONS': {
+        'MAX_ENTRIES': int(os.getenv('USSD_SESSION_MAX_ENTRIES', 10000)),
+        'CACHE_ALIAS': os.getenv('USSD_SESSION_CACHE_ALIAS', 'default'),
+        # Seconds between in-process purges of expired USSDSession rows; 0 leaves it to purge_ussd_sessions.
+        'SWEEP_INTERVAL': int(os.getenv('USSD_SESSION_SWEEP_INTERVAL', 0)),
+        'PURGE_BATCH_SIZE': int(os.getenv('USSD_SESSION_PURGE_BATCH_SIZE', 1000)),
+    },
+}